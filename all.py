@@ -1,22 +1,50 @@
+import io
 import os
+import sys
+import gzip
+import csv
 import json
+import time
+import traceback
+import html
+import bisect
+import hashlib
+import struct
+import contextlib
+import collections
+import pstats
 import asyncio
+import cProfile
+import sqlite3
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from datetime import datetime, timedelta, date
 
+try:
+    import fcntl
+except ImportError:  # Windows: gak ada flock, compact stok jalan tanpa lock file
+    fcntl = None
+
 from telegram import (
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 # ======================================
 # CONFIG
@@ -30,23 +58,71 @@ if not BOT_TOKEN:
 ADMIN_IDS = {7321522905}  # ganti kalau ID lu beda
 
 BASE = Path(__file__).parent
-PREMIUM_FILE = BASE / "premium.json"
-HISTORY_FILE = BASE / "history.json"
-LANG_FILE = BASE / "language.json"  # simpan bahasa user
+# folder data (premium, riwayat, stok) — default sama dengan folder bot,
+# bisa dipindah lewat env DATA_DIR (misal buat benchmark / testing)
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE))
+PREMIUM_FILE = DATA_DIR / "premium.json"
+HISTORY_FILE = DATA_DIR / "history.json"
+HISTORY_DIR = DATA_DIR / "history"  # riwayat per user: history/<uid>.jsonl
+LANG_FILE = DATA_DIR / "language.json"  # simpan bahasa user
 
 # ---------- FILE STOK ----------
 # stok_canva.txt, stok_capcut.txt, dst tetap
-STOK_CANVA = BASE / "stok_canva.txt"
-STOK_CAPCUT = BASE / "stok_capcut.txt"
-STOK_SCRIBD = BASE / "stok_scribd.txt"
-STOK_APPLE = BASE / "stok_apple.txt"
+STOK_CANVA = DATA_DIR / "stok_canva.txt"
+STOK_CAPCUT = DATA_DIR / "stok_capcut.txt"
+STOK_SCRIBD = DATA_DIR / "stok_scribd.txt"
+STOK_APPLE = DATA_DIR / "stok_apple.txt"
 
 # INI YANG DISAMBUNG KE UBOT:
-STOK_VIU = BASE / "stok_viu.txt"   # hasil farmer VIU
-STOK_VIDIO = BASE / "stok_vidio.txt"
+STOK_VIU = DATA_DIR / "stok_viu.txt"   # hasil farmer VIU
+STOK_VIDIO = DATA_DIR / "stok_vidio.txt"
 
 # AM / Alight Motion → ubot biasanya pakai "stok_am.txt"
-STOK_ALIGHT = BASE / "stok_am.txt"  # <--- penting: sesuaikan dengan file ubot
+STOK_ALIGHT = DATA_DIR / "stok_am.txt"  # <--- penting: sesuaikan dengan file ubot
+
+# ---------- RATE LIMIT BOT API ----------
+# Semua request keluar ke Bot API lewat AIORateLimiter (token bucket):
+# limit global per detik + limit per grup per menit, dan otomatis
+# nunggu + retry kalau Telegram balas RetryAfter (flood wait).
+RATE_OVERALL_PER_SEC = float(os.getenv("RATE_OVERALL_PER_SEC", "30"))
+RATE_GROUP_PER_MIN = float(os.getenv("RATE_GROUP_PER_MIN", "20"))
+RATE_MAX_RETRIES = int(os.getenv("RATE_MAX_RETRIES", "3"))
+
+# ---------- MODE JALAN (polling / webhook) ----------
+# BOT_MODE=polling (default) atau webhook. Mode webhook pakai server
+# HTTP bawaan PTB, biasanya di belakang reverse proxy (nginx/caddy)
+# yang nerusin https://<domain>/<WEBHOOK_PATH> ke WEBHOOK_LISTEN:WEBHOOK_PORT.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL publik, contoh: https://bot.domain.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # dicek dari header X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT")  # opsional: TLS langsung tanpa reverse proxy
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY")
+
+# Server Bot API (ganti kalau pakai Bot API server sendiri / fake server buat testing)
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+TELEGRAM_BASE_FILE_URL = os.getenv("TELEGRAM_BASE_FILE_URL", "https://api.telegram.org/file/bot")
+
+# ---------- HTTP TRANSPORT ----------
+# Request biasa (sendMessage, edit, dll) & getUpdates pakai koneksi
+# terpisah, jadi balasan ke user gak pernah ngantri di belakang long-poll.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "256"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "5"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "1"))
+HTTP_VERSION = os.getenv("HTTP_VERSION", "1.1")  # "1.1" atau "2" (HTTP/2 cuma jalan lewat https)
+
+GET_UPDATES_POOL_SIZE = int(os.getenv("GET_UPDATES_POOL_SIZE", "1"))
+GET_UPDATES_READ_TIMEOUT = float(os.getenv("GET_UPDATES_READ_TIMEOUT", "30"))
+
+# ---------- CONCURRENCY ----------
+# Update diproses paralel (max MAX_CONCURRENT_UPDATES yang jalan), tapi
+# update dari user yang sama tetap urut satu-satu.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
 
 # Nama produk untuk tampilan
 PRODUCTS = {
@@ -70,6 +146,12 @@ PRODUCT_LIMIT = {
     "ALIGHT": 15,
 }
 
+# Pilihan jumlah akun per generate. Batch di atas BATCH_DOC_THRESHOLD
+# (atau yang teksnya gak muat 1 pesan) dikirim sebagai file .txt.
+QUANTITY_OPTIONS = (10, 20, 50)
+BATCH_DOC_THRESHOLD = int(os.getenv("BATCH_DOC_THRESHOLD", "20"))
+MESSAGE_LIMIT = 4096
+
 # ======================================
 # TEKS PLAN (ID & EN)
 # ======================================
@@ -224,6 +306,327 @@ PLAN_TEXTS_EN = {
     ),
 }
 
+# ======================================
+# METRICS
+# ======================================
+# Histogram latency ukuran tetap (bucket di LATENCY_BUCKETS) per handler
+# dan per operasi I/O, plus counter calls / byte baca / byte tulis.
+# Dilihat admin lewat /metrics, atau Prometheus di 127.0.0.1:METRICS_PORT.
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = endpoint Prometheus mati
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """Histogram fixed-size: jumlah per bucket + total, gak nyimpen sampel."""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # +1 buat > bucket terakhir
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Perkiraan kuantil (batas atas bucket tempat kuantil itu jatuh)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+
+_metrics_lock = threading.Lock()
+HANDLER_LATENCY = {}  # nama handler -> Histogram
+IO_STATS = {}         # nama operasi -> {"calls", "bytes_read", "bytes_written", "latency"}
+LOOP_LAG = Histogram()
+LOOP_LAG_MAX = [0.0]  # lag terbesar yang pernah kecatat (detik)
+
+# handler yang lagi jalan: id -> (label, data update, waktu mulai);
+# dipakai buat nunjuk "siapa yang bikin loop macet" waktu lag tinggi
+_inflight = {}
+
+
+def record_handler(name: str, duration: float):
+    with _metrics_lock:
+        hist = HANDLER_LATENCY.get(name)
+        if hist is None:
+            hist = HANDLER_LATENCY[name] = Histogram()
+        hist.observe(duration)
+
+
+def record_io(name: str, duration: float = None, bytes_read: int = 0, bytes_written: int = 0):
+    """Catat 1 operasi I/O. duration=None = cuma nambah byte (tanpa hitung call)."""
+    with _metrics_lock:
+        st = IO_STATS.get(name)
+        if st is None:
+            st = IO_STATS[name] = {
+                "calls": 0, "bytes_read": 0, "bytes_written": 0, "latency": Histogram(),
+            }
+        if duration is not None:
+            st["calls"] += 1
+            st["latency"].observe(duration)
+        st["bytes_read"] += bytes_read
+        st["bytes_written"] += bytes_written
+
+
+# Prefix callback data yang boleh jadi label metrik. Data callback bisa
+# dipalsuin client, jadi prefix lain masuk "other" (label tetap terbatas).
+CALLBACK_LABELS = frozenset({
+    "BACK", "EXPORT", "GEN", "HELP", "P", "PLAN", "PLANS", "Q", "SAVED", "SEWA",
+})
+
+
+def _handler_label(fn, update) -> str:
+    name = fn.__name__
+    if isinstance(update, Update) and update.callback_query and update.callback_query.data:
+        # handle_buttons:Q, handle_buttons:P, handle_buttons:SAVED, ...
+        prefix = update.callback_query.data.split("_", 1)[0]
+        name += ":" + (prefix if prefix in CALLBACK_LABELS else "other")
+    return name
+
+
+def _update_data(update) -> str:
+    if not isinstance(update, Update):
+        return ""
+    if update.callback_query:
+        return update.callback_query.data or ""
+    if update.effective_message and update.effective_message.text:
+        return update.effective_message.text[:40]
+    return ""
+
+
+def timed(fn):
+    """Middleware: ukur durasi handler & masukin ke HANDLER_LATENCY."""
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        label = _handler_label(fn, update)
+        key = object()
+        t0 = time.perf_counter()
+        _inflight[key] = (label, _update_data(update), t0)
+        try:
+            return await fn(update, context)
+        finally:
+            _inflight.pop(key, None)
+            record_handler(label, time.perf_counter() - t0)
+    return wrapper
+
+
+METRICS_TEXT_LIMIT = 4000  # di bawah limit 4096 char pesan Telegram
+
+
+def metrics_text() -> str:
+    """Ringkasan buat /metrics (HTML)."""
+    lines = ["📈 <b>Metrics</b>", "━━━━━━━━━━━━━━━━━━━━━━━", "<b>Handler</b> (n | p50 / p95 / p99 ms)"]
+    with _metrics_lock:
+        for name, h in sorted(HANDLER_LATENCY.items()):
+            lines.append(
+                f"• {html.escape(name)}: {h.count} | {h.quantile(0.5) * 1000:g} / "
+                f"{h.quantile(0.95) * 1000:g} / {h.quantile(0.99) * 1000:g}"
+            )
+        lines.append("")
+        lines.append("<b>I/O</b> (calls | read / write KB | p95 ms)")
+        for name, st in sorted(IO_STATS.items()):
+            lines.append(
+                f"• {html.escape(name)}: {st['calls']} | {st['bytes_read'] / 1024:.1f} / "
+                f"{st['bytes_written'] / 1024:.1f} | {st['latency'].quantile(0.95) * 1000:g}"
+            )
+        lines.append("")
+        lines.append("<b>Event loop lag</b> (n | p50 / p95 / p99 / max ms)")
+        lines.append(
+            f"• {LOOP_LAG.count} | {LOOP_LAG.quantile(0.5) * 1000:g} / "
+            f"{LOOP_LAG.quantile(0.95) * 1000:g} / {LOOP_LAG.quantile(0.99) * 1000:g} / "
+            f"{LOOP_LAG_MAX[0] * 1000:.1f}"
+        )
+        stalls = list(LOOP_STALLS)
+
+    text = "\n".join(lines)
+    if stalls:
+        # laporan terbaru duluan, berhenti sebelum lewat limit pesan Telegram
+        text += "\n\n<b>Macet terakhir</b>"
+        for s in reversed(stalls):
+            item = f"\n• {html.escape(s[:300])}"
+            if len(text) + len(item) > METRICS_TEXT_LIMIT:
+                break
+            text += item
+    if len(text) > METRICS_TEXT_LIMIT:
+        text = text[: METRICS_TEXT_LIMIT - 2].rsplit("\n", 1)[0] + "\n…"
+    return text
+
+
+def _prom_label(value: str) -> str:
+    """Escape nilai label Prometheus (backslash, kutip, newline)."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_histogram(out, metric: str, labels: str, h: Histogram):
+    seen = 0
+    for bound, c in zip(LATENCY_BUCKETS, h.counts):
+        seen += c
+        out.append(f'{metric}_bucket{{{labels},le="{bound}"}} {seen}')
+    out.append(f'{metric}_bucket{{{labels},le="+Inf"}} {h.count}')
+    out.append(f"{metric}_sum{{{labels}}} {h.sum}")
+    out.append(f"{metric}_count{{{labels}}} {h.count}")
+
+
+def prometheus_text() -> str:
+    out = [
+        "# TYPE vanzbot_handler_seconds histogram",
+    ]
+    with _metrics_lock:
+        for name, h in sorted(HANDLER_LATENCY.items()):
+            _prom_histogram(out, "vanzbot_handler_seconds", f'handler="{_prom_label(name)}"', h)
+        out.append("# TYPE vanzbot_io_seconds histogram")
+        for name, st in sorted(IO_STATS.items()):
+            _prom_histogram(out, "vanzbot_io_seconds", f'op="{_prom_label(name)}"', st["latency"])
+        for key in ("calls", "bytes_read", "bytes_written"):
+            out.append(f"# TYPE vanzbot_io_{key}_total counter")
+            for name, st in sorted(IO_STATS.items()):
+                out.append(f'vanzbot_io_{key}_total{{op="{_prom_label(name)}"}} {st[key]}')
+        out.append("# TYPE vanzbot_loop_lag_seconds histogram")
+        _prom_histogram(out, "vanzbot_loop_lag_seconds", 'loop="main"', LOOP_LAG)
+    return "\n".join(out) + "\n"
+
+
+# ---------- EVENT LOOP LAG ----------
+# Task background tidur LOOP_LAG_INTERVAL detik lalu ngukur telatnya
+# bangun = berapa lama loop ke-block (masuk histogram LOOP_LAG).
+# Thread watchdog ngecek heartbeat task itu; kalau macet lebih dari
+# LOOP_SLOW_CALLBACK_MS, handler yang lagi jalan (+ callback data-nya)
+# di-log SAAT loop masih ke-block, jadi pelakunya ketangkep.
+# LOOP_DEBUG=1 sekalian nyalain debug mode asyncio, yang nge-log tiap
+# callback yang jalan lebih lama dari threshold yang sama.
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_SLOW_CALLBACK_MS = float(os.getenv("LOOP_SLOW_CALLBACK_MS", "100"))
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0") == "1"
+
+LOOP_STALLS = collections.deque(maxlen=10)  # laporan macet terakhir (buat /metrics)
+LOOP_STALL_INFLIGHT = 5     # max handler in-flight yang ikut di laporan
+LOOP_STALL_STACK = 8        # max frame stack thread loop yang di-log
+_loop_heartbeat = [0.0]
+
+
+def _inflight_snapshot() -> str:
+    """Handler in-flight paling lama (max LOOP_STALL_INFLIGHT) + sisanya."""
+    now = time.perf_counter()
+    try:
+        items = list(_inflight.values())
+    except RuntimeError:  # dict lagi diubah loop, coba lagi di cek berikutnya
+        return "?"
+    items.sort(key=lambda it: it[2])
+    shown = ", ".join(
+        f"{label}[{data[:20]}] {(now - t) * 1000:.0f}ms"
+        for label, data, t in items[:LOOP_STALL_INFLIGHT]
+    ) or "-"
+    if len(items) > LOOP_STALL_INFLIGHT:
+        shown += f" (+{len(items) - LOOP_STALL_INFLIGHT} lagi)"
+    return shown
+
+
+def _loop_stack(thread_id: int):
+    """
+    Stack thread event loop saat ini (frame paling dalam terakhir).
+    Dipanggil pas loop lagi ke-block, jadi ini kode yang bikin macet.
+    """
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return []
+    return traceback.extract_stack(frame)[-LOOP_STALL_STACK:]
+
+
+def _loop_culprit(stack) -> str:
+    """Frame terdalam, plus frame terdalam di file bot ini kalau beda (misal macetnya di library)."""
+    if not stack:
+        return "?"
+
+    def fmt(fs):
+        return f"{fs.name} ({Path(fs.filename).name}:{fs.lineno})"
+
+    inner = stack[-1]
+    for fs in reversed(stack):
+        if fs.filename == __file__:
+            return fmt(inner) if fs is inner else f"{fmt(inner)} via {fmt(fs)}"
+    return fmt(inner)
+
+
+def _loop_watchdog(stop: threading.Event, loop_thread_id: int):
+    threshold = LOOP_SLOW_CALLBACK_MS / 1000
+    reported = 0.0
+    while not stop.wait(min(threshold, LOOP_LAG_INTERVAL) / 2):
+        beat = _loop_heartbeat[0]
+        stalled = time.perf_counter() - beat - LOOP_LAG_INTERVAL
+        if beat and stalled >= threshold and beat != reported:
+            reported = beat
+            stack = _loop_stack(loop_thread_id)
+            report = (
+                f"{datetime.now():%H:%M:%S} macet ≥{stalled * 1000:.0f} ms di "
+                f"{_loop_culprit(stack)}; in-flight: {_inflight_snapshot()}"
+            )
+            LOOP_STALLS.append(report)
+            print(f"[loop] {report}")
+            print("".join(traceback.format_list(stack)).rstrip())
+
+
+async def loop_lag_monitor():
+    loop = asyncio.get_running_loop()
+    loop.slow_callback_duration = LOOP_SLOW_CALLBACK_MS / 1000
+    if LOOP_DEBUG:
+        loop.set_debug(True)
+
+    stop = threading.Event()
+    threading.Thread(
+        target=_loop_watchdog, args=(stop, threading.get_ident()), name="loop-watchdog", daemon=True
+    ).start()
+    try:
+        while True:
+            t0 = loop.time()
+            _loop_heartbeat[0] = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(loop.time() - t0 - LOOP_LAG_INTERVAL, 0.0)
+            with _metrics_lock:
+                LOOP_LAG.observe(lag)
+                LOOP_LAG_MAX[0] = max(LOOP_LAG_MAX[0], lag)
+    finally:
+        stop.set()
+
+
+def start_metrics_server(port: int):
+    """Endpoint Prometheus (GET /metrics) di 127.0.0.1:port, jalan di thread sendiri."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
 # ======================================
 # JSON HELPERS
 # ======================================
@@ -231,186 +634,920 @@ PLAN_TEXTS_EN = {
 def load_json(path: Path, default):
     if not path.exists():
         return default
+    t0 = time.perf_counter()
+    try:
+        with path.open("rb") as f:
+            raw = f.read()
+    except OSError:
+        return default
+    record_io("load_json", time.perf_counter() - t0, bytes_read=len(raw))
     try:
-        with path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        return json.loads(raw)
     except Exception:
         return default
 
 
 def save_json(path: Path, data):
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    t0 = time.perf_counter()
+    raw = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    with path.open("wb") as f:
+        f.write(raw)
+    record_io("save_json", time.perf_counter() - t0, bytes_written=len(raw))
+
+# ======================================
+# STATE STORE (SQLite, WAL)
+# ======================================
+# premium / quota / bahasa disimpan per-baris di SQLite,
+# jadi lookup & update 1 user gak perlu parse/tulis ulang seluruh file.
+# (riwayat akun ada di HISTORY_DIR, lihat HISTORY SYSTEM.)
+# File json lama (premium.json, history.json, language.json) di-import
+# sekali waktu DB pertama kali dibuka, lalu dibiarkan sebagai backup.
+
+DB_FILE = DATA_DIR / "vanzbot.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS premium (
+    uid INTEGER PRIMARY KEY,
+    expire_at TEXT,
+    total_generated INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS quota (
+    uid INTEGER NOT NULL,
+    produk TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (uid, produk)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lang (
+    uid INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+_conn = None
+# koneksi dipakai bareng oleh thread-thread storage, jadi aksesnya di-lock
+_db_lock = threading.RLock()
+
+
+def get_db() -> sqlite3.Connection:
+    """Koneksi SQLite global (dibuka sekali, mode WAL). Pakai di bawah _db_lock."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _migrate_json(conn)
+        _migrate_history_table(conn)
+        _conn = conn
+    return _conn
+
+
+def _migrate_json(conn: sqlite3.Connection):
+    """Import premium.json / history.json / language.json (sekali saja)."""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return
+
+    premium = load_json(PREMIUM_FILE, {})
+    history = load_json(HISTORY_FILE, {})
+    langs = load_json(LANG_FILE, {})
+
+    with conn:
+        for uid_str, rec in premium.items():
+            try:
+                uid = int(uid_str)
+            except ValueError:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO premium (uid, expire_at, total_generated) "
+                "VALUES (?, ?, ?)",
+                (uid, rec.get("expire_at"), rec.get("total_generated", 0)),
+            )
+            for p_key, entry in (rec.get("quota") or {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO quota (uid, produk, day, count) "
+                    "VALUES (?, ?, ?, ?)",
+                    (uid, p_key, entry.get("date", ""), entry.get("count", 0)),
+                )
+
+        for uid_str, lst in history.items():
+            try:
+                uid = int(uid_str)
+            except ValueError:
+                continue
+            _append_history_lines(uid, _history_entries(lst))
+
+        for uid_str, lang in langs.items():
+            try:
+                uid = int(uid_str)
+            except ValueError:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO lang (uid, lang) VALUES (?, ?)",
+                (uid, lang),
+            )
+
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+
+
+def _migrate_history_table(conn: sqlite3.Connection):
+    """Pindahin tabel history (format DB lama) ke file per user."""
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'"
+    ).fetchone():
+        return
+
+    per_user = {}
+    for uid, akun, produk in conn.execute(
+        "SELECT uid, akun, produk FROM history ORDER BY id"
+    ):
+        per_user.setdefault(uid, []).append({"akun": akun, "produk": produk})
+    for uid, lst in per_user.items():
+        _append_history_lines(uid, _history_entries(lst))
+
+    with conn:
+        conn.execute("DROP TABLE history")
 
 # ======================================
 # LANGUAGE SYSTEM
 # ======================================
 
 def get_lang(uid: int) -> str:
-    db = load_json(LANG_FILE, {})
-    return db.get(str(uid), "id")  # default Indonesia
+    with _db_lock:
+        row = get_db().execute("SELECT lang FROM lang WHERE uid = ?", (uid,)).fetchone()
+    return row[0] if row else "id"  # default Indonesia
 
 
 def set_lang(uid: int, lang: str):
     if lang not in ("id", "en"):
         lang = "id"
-    db = load_json(LANG_FILE, {})
-    db[str(uid)] = lang
-    save_json(LANG_FILE, db)
+    with _db_lock:
+        conn = get_db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO lang (uid, lang) VALUES (?, ?)",
+                (uid, lang),
+            )
 
 # ======================================
 # PREMIUM SYSTEM
 # ======================================
+# Record premium di-cache di memori (bentuknya sama kayak premium.json lama).
+# Semua perubahan cuma nandain uid "dirty", lalu flush_premium_db() nulis
+# semua yang dirty dalam 1 transaksi SQLite — dipanggil berkala tiap
+# PREMIUM_FLUSH_MS dan sekali lagi waktu bot shutdown.
+# Cache diubah dari event loop, flush jalan di thread storage —
+# keduanya lewat _premium_lock.
+
+PREMIUM_FLUSH_MS = int(os.getenv("PREMIUM_FLUSH_MS", "500"))
+
+_premium_cache = None   # {uid: {"expire_at": ..., "quota": {...}, "total_generated": ...}}
+_premium_dirty = set()  # uid yang berubah (atau dihapus) sejak flush terakhir
+_premium_lock = threading.RLock()
+
 
 def is_admin(uid: int) -> bool:
     return uid in ADMIN_IDS
 
 
+def _premium_db():
+    """Cache premium; di-load dari SQLite sekali saja."""
+    global _premium_cache
+    if _premium_cache is None:
+        with _premium_lock, _db_lock:
+            if _premium_cache is not None:
+                return _premium_cache
+            conn = get_db()
+            cache = {}
+            for uid, exp, total in conn.execute(
+                "SELECT uid, expire_at, total_generated FROM premium"
+            ):
+                cache[uid] = {"expire_at": exp, "quota": {}, "total_generated": total}
+            for uid, p_key, day, count in conn.execute(
+                "SELECT uid, produk, day, count FROM quota"
+            ):
+                rec = cache.get(uid)
+                if rec is not None:
+                    rec["quota"][p_key] = {"date": day, "count": count}
+            _premium_cache = cache
+    return _premium_cache
+
+
+def flush_premium_db() -> int:
+    """Tulis semua record dirty ke SQLite dalam 1 transaksi. Return jumlah uid."""
+    if not _premium_dirty:
+        return 0
+    t0 = time.perf_counter()
+    db = _premium_db()
+    # snapshot dulu di bawah lock, nulis ke disk-nya di luar lock
+    with _premium_lock:
+        dirty = list(_premium_dirty)
+        _premium_dirty.clear()
+        rows = []
+        for uid in dirty:
+            rec = db.get(uid)
+            if rec is None:
+                rows.append((uid, None, []))
+                continue
+            quota = [
+                (uid, p_key, e.get("date", ""), e.get("count", 0))
+                for p_key, e in rec.get("quota", {}).items()
+            ]
+            rows.append(
+                (uid, (uid, rec.get("expire_at"), rec.get("total_generated", 0)), quota)
+            )
+
+    try:
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                for uid, premium_row, quota in rows:
+                    conn.execute("DELETE FROM quota WHERE uid = ?", (uid,))
+                    if premium_row is None:
+                        conn.execute("DELETE FROM premium WHERE uid = ?", (uid,))
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO premium (uid, expire_at, total_generated) "
+                        "VALUES (?, ?, ?)",
+                        premium_row,
+                    )
+                    conn.executemany(
+                        "INSERT INTO quota (uid, produk, day, count) VALUES (?, ?, ?, ?)",
+                        quota,
+                    )
+    except sqlite3.Error:
+        # transaksi di-rollback, coba lagi di flush berikutnya
+        _premium_dirty.update(dirty)
+        raise
+    record_io("premium_flush", time.perf_counter() - t0)
+    return len(dirty)
+
+
+async def premium_flush_loop():
+    """Background task: flush premium cache tiap PREMIUM_FLUSH_MS."""
+    while True:
+        await asyncio.sleep(PREMIUM_FLUSH_MS / 1000)
+        try:
+            await run_storage(flush_premium_db)
+        except sqlite3.Error as e:
+            print(f"[premium] flush gagal: {e}")
+
+
+def _mark_dirty(uid: int):
+    _premium_dirty.add(uid)
+
+
+def get_premium_rec(uid: int):
+    """
+    Record premium 1 user:
+    {"expire_at": "...", "quota": {"CANVA": {"date": ..., "count": ...}}, "total_generated": 0}
+    Return None kalau user belum pernah terdaftar.
+    """
+    return _premium_db().get(uid)
+
+
 def get_premium_db():
-    return load_json(PREMIUM_FILE, {})
+    """Semua record premium (dipakai /listpremium)."""
+    return {str(uid): rec for uid, rec in sorted(_premium_db().items())}
 
 
-def save_premium_db(db):
-    save_json(PREMIUM_FILE, db)
+def del_premium(uid: int) -> bool:
+    db = _premium_db()
+    with _premium_lock:
+        if uid not in db:
+            return False
+        db.pop(uid)
+        _mark_dirty(uid)
+    return True
 
 
-def is_premium(uid: int) -> bool:
-    db = get_premium_db()
-    rec = db.get(str(uid))
-    if not rec:
-        return False
-    exp = rec.get("expire_at")
-    if not exp:
-        return False
+def _get_expire(uid: int):
+    rec = _premium_db().get(uid)
+    if not rec or not rec.get("expire_at"):
+        return None
     try:
-        exp_date = datetime.strptime(exp, "%Y-%m-%d").date()
+        return datetime.strptime(rec["expire_at"], "%Y-%m-%d").date()
     except ValueError:
+        return None
+
+
+def is_premium(uid: int) -> bool:
+    exp_date = _get_expire(uid)
+    if not exp_date:
         return False
     return date.today() <= exp_date
 
 
 def get_sisa_sewa(uid: int) -> int:
-    db = get_premium_db()
-    rec = db.get(str(uid), {})
-    exp = rec.get("expire_at")
-    if not exp:
-        return 0
-    try:
-        exp_date = datetime.strptime(exp, "%Y-%m-%d").date()
-    except ValueError:
+    exp_date = _get_expire(uid)
+    if not exp_date:
         return 0
     return max((exp_date - date.today()).days, 0)
 
 
-def update_quota(uid: int):
+# Quota harian disimpan sebagai pasangan (tanggal, jumlah) per produk.
+# Kalau tanggalnya bukan hari ini, dibaca sebagai 0 — resetnya baru
+# beneran ditulis waktu increment berikutnya. Jadi cek quota gak
+# pernah nulis apa-apa.
+
+def _today() -> str:
+    return date.today().strftime("%Y-%m-%d")
+
+
+def quota_used(rec, produk_key: str, today: str = None) -> int:
+    """Pemakaian hari ini dari record premium (0 kalau tanggalnya basi)."""
+    if not rec:
+        return 0
+    entry = rec.get("quota", {}).get(produk_key)
+    if not entry or entry.get("date") != (today or _today()):
+        return 0
+    return entry.get("count", 0)
+
+
+def reserve_quota(uid: int, produk_key: str, n: int, unlimited: bool = False) -> int:
     """
-    Simpan quota per produk di premium.json:
-    {
-      "uid": {
-        "expire_at": "...",
-        "quota": {
-          "CANVA": {"date": "2025-01-10", "count": 0},
-          ...
-        },
-        "total_generated": 0
-      }
-    }
+    Pesan sampai n quota sekaligus (atomik). Return jumlah yang dapat
+    (0 kalau limit hari ini sudah habis). Setelah akun dikirim, WAJIB
+    ditutup dengan commit_quota() — sisa yang gak kepakai dibalikin.
     """
-    today = date.today().strftime("%Y-%m-%d")
-    db = get_premium_db()
-    rec = db.get(str(uid), {
-        "expire_at": None,
-        "quota": {},
-        "total_generated": 0,
-    })
-
-    quota = rec.get("quota", {})
-    # reset harian jika beda tanggal
-    for p_key in PRODUCT_LIMIT.keys():
-        entry = quota.get(p_key, {"date": today, "count": 0})
-        if entry.get("date") != today:
-            entry["date"] = today
-            entry["count"] = 0
-        quota[p_key] = entry
-
-    rec["quota"] = quota
-    db[str(uid)] = rec
-    save_premium_db(db)
-    return rec
-
-
-def increment_quota(uid: int, produk_key: str):
-    db = get_premium_db()
-    rec = db.get(str(uid))
-    if not rec:
-        return
-    quota = rec.get("quota", {})
-    today = date.today().strftime("%Y-%m-%d")
-    entry = quota.get(produk_key, {"date": today, "count": 0})
-    if entry.get("date") != today:
-        entry["date"] = today
-        entry["count"] = 0
-    entry["count"] = entry.get("count", 0) + 1
-    quota[produk_key] = entry
-    rec["quota"] = quota
-    rec["total_generated"] = rec.get("total_generated", 0) + 1
-    db[str(uid)] = rec
-    save_premium_db(db)
-
-
-def get_quota_info(uid: int, produk_key: str):
-    db = get_premium_db()
-    rec = db.get(str(uid))
-    if not rec:
-        return 0, PRODUCT_LIMIT.get(produk_key, 0)
-    quota = rec.get("quota", {})
-    entry = quota.get(produk_key)
-    if not entry:
-        return 0, PRODUCT_LIMIT.get(produk_key, 0)
-    today = date.today().strftime("%Y-%m-%d")
-    if entry.get("date") != today:
-        return 0, PRODUCT_LIMIT.get(produk_key, 0)
-    used = entry.get("count", 0)
-    limit = PRODUCT_LIMIT.get(produk_key, 0)
-    return used, limit
+    if n <= 0:
+        return 0
+    today = _today()
+    db = _premium_db()
+    with _premium_lock:
+        rec = db.get(uid)
+        if rec is None:
+            # admin / user tanpa record tetap dicatat total_generated-nya
+            rec = {"expire_at": None, "quota": {}, "total_generated": 0}
+            db[uid] = rec
+        used = quota_used(rec, produk_key, today)
+        if not unlimited:
+            n = min(n, max(PRODUCT_LIMIT.get(produk_key, 0) - used, 0))
+        if n > 0:
+            rec["quota"][produk_key] = {"date": today, "count": used + n}
+    return n
+
+
+def commit_quota(uid: int, produk_key: str, reserved: int, served: int):
+    """Tutup reservasi: catat yang beneran terkirim, refund sisanya."""
+    refund = reserved - served
+    db = _premium_db()
+    with _premium_lock:
+        rec = db.get(uid)
+        if rec is None:
+            return
+        entry = rec["quota"].get(produk_key)
+        if refund > 0 and entry and entry.get("date") == _today():
+            entry["count"] = max(entry.get("count", 0) - refund, 0)
+        rec["total_generated"] = rec.get("total_generated", 0) + served
+        _mark_dirty(uid)
 
 
 def grant_premium_days(uid: int, days: int) -> date:
-    db = get_premium_db()
     today = date.today()
-    rec = db.get(str(uid), {})
-    if rec.get("expire_at"):
-        try:
-            old_exp = datetime.strptime(rec["expire_at"], "%Y-%m-%d").date()
-        except ValueError:
-            old_exp = today
-    else:
-        old_exp = today
+    old_exp = _get_expire(uid) or today
     new_expire = max(old_exp, today) + timedelta(days=days)
 
-    rec["expire_at"] = new_expire.strftime("%Y-%m-%d")
-    # reset quota hari ini
-    rec["quota"] = {}
-    rec["total_generated"] = rec.get("total_generated", 0)
-    db[str(uid)] = rec
-    save_premium_db(db)
+    db = _premium_db()
+    with _premium_lock:
+        rec = db.get(uid) or {"expire_at": None, "quota": {}, "total_generated": 0}
+        rec["expire_at"] = new_expire.strftime("%Y-%m-%d")
+        # reset quota hari ini
+        rec["quota"] = {}
+        db[uid] = rec
+        _mark_dirty(uid)
     return new_expire
 
 # ======================================
 # HISTORY SYSTEM
 # ======================================
 
-def get_history(uid: int):
-    db = load_json(HISTORY_FILE, {})
-    return db.get(str(uid), [])
+# Tiap user punya file sendiri (history/<uid>.jsonl), 1 baris = 1 akun.
+# Nambah riwayat cuma append ke file user itu, baca riwayat juga cuma
+# baca file user itu — gak nyentuh riwayat user lain.
+#
+# Di sebelahnya ada history/<uid>.idx: offset byte awal tiap baris
+# (8 byte per entry). Buka halaman K cukup baca potongan .idx + potongan
+# .jsonl yang dibutuhin, gak peduli riwayatnya udah sepanjang apa.
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+
+# Retensi: yang "panas" (di .jsonl) cuma HISTORY_KEEP_ENTRIES entry terakhir
+# dan yang umurnya < HISTORY_KEEP_DAYS hari (0 = gak dibatasi umur).
+# Sisanya dipindah background job ke arsip gzip (lihat ARSIP RIWAYAT).
+HISTORY_KEEP_ENTRIES = int(os.getenv("HISTORY_KEEP_ENTRIES", "500"))
+HISTORY_KEEP_DAYS = int(os.getenv("HISTORY_KEEP_DAYS", "90"))
+HISTORY_ARCHIVE_BATCH = int(os.getenv("HISTORY_ARCHIVE_BATCH", "100"))  # min kelebihan sebelum dipindah
+HISTORY_ARCHIVE_MAX_SEGMENTS = int(os.getenv("HISTORY_ARCHIVE_MAX_SEGMENTS", "8"))
+HISTORY_COMPACT_INTERVAL = int(os.getenv("HISTORY_COMPACT_INTERVAL", "3600"))  # detik
+HISTORY_ARCHIVE_DIR = HISTORY_DIR / "archive"  # archive/<uid>/<awal>-<akhir>-<jumlah>.jsonl.gz
+
+# Format baris: [ts, kode produk, akun], misal
+#   [1792309069,"VIU","mail@x.com | pass | 95310 Days"]
+# Nama produk (PRODUCTS) baru dipakai waktu ditampilin. Baris format lama
+# ({"akun": ..., "produk": "<nama produk>"}) tetap kebaca; namanya
+# dipetain balik ke kode kalau masih ada di PRODUCTS.
+
+_PRODUCT_KEY_BY_NAME = {nama: key for key, nama in PRODUCTS.items()}
+
+
+class HistoryEntry:
+    __slots__ = ("ts", "produk", "akun")
+
+    def __init__(self, ts: int, produk: str, akun: str):
+        self.ts = ts  # 0 = gak diketahui (entry format lama)
+        self.produk = sys.intern(produk)  # kode produk, dishare antar entry
+        self.akun = akun
+
+    @property
+    def nama(self) -> str:
+        return PRODUCTS.get(self.produk, self.produk)
+
+    def encode(self) -> bytes:
+        return (json.dumps([self.ts, self.produk, self.akun], ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    @classmethod
+    def from_obj(cls, obj):
+        """Dari hasil json.loads (format baru / lama). None kalau gak valid."""
+        if isinstance(obj, list) and len(obj) == 3:
+            return cls(obj[0] or 0, str(obj[1]), str(obj[2]))
+        if isinstance(obj, dict) and "akun" in obj:
+            nama = str(obj.get("produk", ""))
+            return cls(obj.get("ts") or 0, _PRODUCT_KEY_BY_NAME.get(nama, nama), str(obj["akun"]))
+        return None
+
+    @classmethod
+    def from_line(cls, line):
+        try:
+            return cls.from_obj(json.loads(line))
+        except ValueError:
+            return None
+
+
+def _history_entries(objs):
+    return [e for e in map(HistoryEntry.from_obj, objs) if e]
+
+
+_history_locks = {}  # uid -> [threading.Lock, jumlah thread yang pakai]
+_history_locks_guard = threading.Lock()  # jaga _history_locks, _history_touched & _history_compacting
+_history_touched = set()  # uid yang nambah riwayat sejak compact terakhir
+_history_compacting = set()  # uid yang lagi di-compact
+_IDX = struct.Struct("<Q")
+
+
+@contextlib.contextmanager
+def _history_lock(uid: int):
+    """Lock riwayat 1 user; user lain gak ikut nunggu."""
+    with _history_locks_guard:
+        entry = _history_locks.get(uid)
+        if entry is None:
+            entry = _history_locks[uid] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _history_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _history_locks[uid]
+
+
+def _history_file(uid: int) -> Path:
+    return HISTORY_DIR / f"{uid}.jsonl"
+
+
+def _history_idx_file(uid: int) -> Path:
+    return HISTORY_DIR / f"{uid}.idx"
+
+
+def _sync_history_index(uid: int):
+    """
+    Pastiin .idx nutup semua baris di .jsonl.
+    Balikin (jumlah entry, offset akhir baris lengkap terakhir).
+    Index yang ketinggalan (file lama / crash di tengah append) dilanjutin
+    dari baris terakhir yang ke-index; yang gak nyambung dibangun ulang.
+    Wajib dipanggil dengan _history_lock(uid) dipegang.
+    """
+    path = _history_file(uid)
+    idx_path = _history_idx_file(uid)
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return 0, 0
+
+    try:
+        idx_size = idx_path.stat().st_size
+    except FileNotFoundError:
+        idx_size = 0
+    count = idx_size // _IDX.size
+
+    with path.open("rb") as f:
+        pos = 0
+        if count:
+            with idx_path.open("rb") as fi:
+                fi.seek((count - 1) * _IDX.size)
+                last = _IDX.unpack(fi.read(_IDX.size))[0]
+            if last < size:
+                f.seek(last)
+                f.readline()
+                pos = f.tell()
+            if last >= size or pos > size:
+                count, pos = 0, 0
+        if idx_size == count * _IDX.size and pos == size:
+            return count, pos
+
+        # lanjutin (atau bangun ulang) index dari pos
+        f.seek(pos)
+        offsets = []
+        nbytes = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # ekor kepotong, bukan entry
+            offsets.append(pos)
+            pos += len(line)
+            nbytes += len(line)
+
+    if offsets or idx_size != count * _IDX.size:
+        with idx_path.open("r+b" if idx_path.exists() else "wb") as fi:
+            fi.truncate(count * _IDX.size)
+            fi.seek(count * _IDX.size)
+            fi.write(b"".join(_IDX.pack(o) for o in offsets))
+        record_io("history_reindex", bytes_read=nbytes, bytes_written=len(offsets) * _IDX.size)
+    return count + len(offsets), pos
+
+
+def _append_history_lines(uid: int, entries):
+    if not entries:
+        return
+    HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    lines = [e.encode() for e in entries]
+    with _history_lock(uid):
+        _, end = _sync_history_index(uid)
+        path = _history_file(uid)
+        with path.open("ab") as f:
+            pos = f.seek(0, os.SEEK_END)
+            if pos > end:
+                # buang ekor baris yang kepotong waktu crash
+                f.truncate(end)
+                pos = end
+            offsets = []
+            for line in lines:
+                offsets.append(pos)
+                pos += len(line)
+            f.write(b"".join(lines))
+        with _history_idx_file(uid).open("ab") as fi:
+            fi.write(b"".join(_IDX.pack(o) for o in offsets))
+    with _history_locks_guard:
+        _history_touched.add(uid)
+    record_io(
+        "history_append", time.perf_counter() - t0,
+        bytes_written=pos - offsets[0] + len(offsets) * _IDX.size,
+    )
+
+
+def iter_history(uid: int):
+    """
+    Semua riwayat user (arsip + yang panas), urut dari yang paling lama.
+    File dibuka sekaligus di bawah lock, jadi compact yang jalan barengan
+    gak bikin entry kelewat / dobel; bacanya sendiri di luar lock.
+    """
+    with _history_lock(uid):
+        files = [gzip.open(p, "rb") for p in _archive_segments(uid)]
+        try:
+            files.append(_history_file(uid).open("rb"))
+        except FileNotFoundError:
+            pass
+
+    t0 = time.perf_counter()
+    nbytes = 0
+    try:
+        for f in files:
+            for line in f:
+                nbytes += len(line)
+                if not line.endswith(b"\n"):
+                    continue  # ekor kepotong waktu crash
+                entry = HistoryEntry.from_line(line)
+                if entry:  # baris rusak di-skip aja
+                    yield entry
+    finally:
+        for f in files:
+            f.close()
+        record_io("history_read", time.perf_counter() - t0, bytes_read=nbytes)
+
+
+def get_history_page(uid: int, page: int, size: int = HISTORY_PAGE_SIZE):
+    """
+    Ambil 1 halaman riwayat panas, terbaru duluan (page 0 = paling baru).
+    Balikin (entries, total, page, archived); entries = [(no, entry)],
+    archived = jumlah entry di arsip. total & no ikut ngitung arsip
+    (no mulai dari 1 = entry paling lama), page cuma nyakup yang panas.
+    """
+    t0 = time.perf_counter()
+    with _history_lock(uid):
+        archived = _archive_count(_archive_segments(uid))
+        hot, tail = _sync_history_index(uid)
+        if not hot:
+            return [], archived, 0, archived
+        pages = (hot + size - 1) // size
+        page = min(max(page, 0), pages - 1)
+        end = hot - page * size
+        start = max(end - size, 0)
+
+        with _history_idx_file(uid).open("rb") as fi:
+            fi.seek(start * _IDX.size)
+            raw_idx = fi.read((end - start + 1) * _IDX.size)
+        offsets = [o for (o,) in _IDX.iter_unpack(raw_idx[: (len(raw_idx) // _IDX.size) * _IDX.size])]
+        first = offsets[0]
+        stop = offsets[end - start] if len(offsets) > end - start else tail
+
+        with _history_file(uid).open("rb") as f:
+            f.seek(first)
+            chunk = f.read(stop - first)
+
+    entries = []
+    for no, line in enumerate(chunk.splitlines(), archived + start + 1):
+        entry = HistoryEntry.from_line(line)
+        if entry:
+            entries.append((no, entry))
+    entries.reverse()
+    record_io("history_page", time.perf_counter() - t0, bytes_read=len(chunk) + len(raw_idx))
+    return entries, archived + hot, page, archived
+
+
+def add_history_batch(uid: int, akun_list, produk_key: str):
+    """Simpan banyak akun sekaligus (1x append)."""
+    ts = int(time.time())
+    _append_history_lines(uid, [HistoryEntry(ts, produk_key, a) for a in akun_list])
+
+
+EXPORT_CHUNK_LINES = 500
+
+
+def export_history(uid: int, fmt: str = "txt", produk_key=None, since=None, until=None):
+    """
+    Tulis riwayat user (arsip + panas) ke BytesIO, per potongan
+    EXPORT_CHUNK_LINES baris, tanpa ngumpulin semua entry dulu.
+    fmt "txt" / "csv"; since/until = date (inklusif). Entry format lama
+    yang gak punya waktu ikut kefilter keluar kalau pakai filter tanggal.
+    Balikin (buffer, jumlah entry).
+    """
+    t0 = time.perf_counter()
+    buf = io.BytesIO()
+    chunk = io.StringIO()
+    writer = csv.writer(chunk) if fmt == "csv" else None
+    if writer:
+        writer.writerow(["waktu", "kode", "produk", "akun"])
+
+    def flush():
+        buf.write(chunk.getvalue().encode("utf-8"))
+        chunk.seek(0)
+        chunk.truncate()
+
+    n = 0
+    for h in iter_history(uid):
+        if produk_key and h.produk != produk_key:
+            continue
+        when = datetime.fromtimestamp(h.ts) if h.ts else None
+        if since or until:
+            if not when or (since and when.date() < since) or (until and when.date() > until):
+                continue
+        waktu = f"{when:%Y-%m-%d %H:%M}" if when else "-"
+        if writer:
+            writer.writerow([waktu, h.produk, h.nama, h.akun])
+        else:
+            chunk.write(f"{waktu} | {h.nama} | {h.akun}\n")
+        n += 1
+        if n % EXPORT_CHUNK_LINES == 0:
+            flush()
+    flush()
+    buf.seek(0)
+    record_io("history_export", time.perf_counter() - t0, bytes_written=buf.getbuffer().nbytes)
+    return buf, n
+
+# ---------- ARSIP RIWAYAT ----------
+# Riwayat lama dipindah ke history/archive/<uid>/ sebagai segmen gzip.
+# Segmen gak pernah diubah: tiap pemindahan bikin segmen baru, dan kalau
+# segmennya udah kebanyakan, semuanya digabung jadi 1 segmen baru
+# (tulis tmp -> rename -> hapus yang lama). Nama segmen
+# <awal>-<akhir>-<jumlah entry> (awal/akhir = nomor urut); segmen yang
+# rentangnya ketutup segmen lain (sisa crash waktu gabung) diabaikan.
+# Jumlah entry di nama dipakai buat total & penomoran di viewer, jadi
+# gak perlu buka arsipnya. Kalau crash pas mindahin dari file panas,
+# paling jelek entry-nya dobel, gak pernah hilang.
+
+
+def _archive_dir(uid: int) -> Path:
+    return HISTORY_ARCHIVE_DIR / str(uid)
+
+
+def _segment_info(path: Path):
+    """(awal, akhir, jumlah entry) dari nama segmen."""
+    first, last, count = (int(x) for x in path.name[: -len(".jsonl.gz")].split("-"))
+    return first, last, count
+
+
+def _archive_segments(uid: int):
+    """Segmen arsip yang masih berlaku, urut dari yang paling lama."""
+    try:
+        names = os.listdir(_archive_dir(uid))
+    except FileNotFoundError:
+        return []
+    segs = []
+    for name in names:
+        if not name.endswith(".jsonl.gz"):
+            continue
+        path = _archive_dir(uid) / name
+        try:
+            first, last, _ = _segment_info(path)
+        except ValueError:
+            continue
+        segs.append((first, -last, path))
+    segs.sort()
+    out = []
+    covered = 0
+    for first, neg_last, path in segs:
+        if -neg_last <= covered:
+            continue
+        covered = -neg_last
+        out.append(path)
+    return out
+
+
+def _archive_count(segs) -> int:
+    return sum(_segment_info(p)[2] for p in segs)
+
+
+def _build_archive_segment(uid: int, first: int, last: int, count: int, chunks):
+    """
+    Tulis segmen ke file .tmp (di luar lock, ini yang berat: gzip + fsync).
+    Balikin (tmp, path, ukuran); os.replace(tmp, path) di bawah lock user.
+    """
+    adir = _archive_dir(uid)
+    adir.mkdir(parents=True, exist_ok=True)
+    path = adir / f"{first:08d}-{last:08d}-{count}.jsonl.gz"
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+            for chunk in chunks:
+                gz.write(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+        size = raw.tell()
+    return tmp, path, size
+
+
+def _merge_archive_segments(uid: int) -> int:
+    """Gabung segmen kalau kebanyakan. Dipanggil dari compact_history (1 per user)."""
+    segs = _archive_segments(uid)
+    if len(segs) <= HISTORY_ARCHIVE_MAX_SEGMENTS:
+        return 0
+    first = _segment_info(segs[0])[0]
+    last = _segment_info(segs[-1])[1]
+
+    def chunks():
+        for p in segs:
+            with gzip.open(p, "rb") as f:
+                while True:
+                    buf = f.read(64 * 1024)
+                    if not buf:
+                        break
+                    yield buf
+
+    tmp, path, size = _build_archive_segment(uid, first, last, _archive_count(segs), chunks())
+    with _history_lock(uid):
+        os.replace(tmp, path)
+        for p in segs:
+            p.unlink(missing_ok=True)
+    return size
+
+
+def _line_offsets(lines, pos: int = 0):
+    offsets = []
+    for line in lines:
+        offsets.append(pos)
+        pos += len(line)
+    return offsets, pos
+
+
+def compact_history(uid: int) -> int:
+    """
+    Pindahin riwayat di luar retensi ke arsip. Balikin jumlah entry yang
+    dipindah (0 kalau belum perlu).
+    Segmen & file panas baru disiapin di luar lock; lock user cuma
+    dipegang buat baca snapshot, ambil ekor yang ke-append sementara itu,
+    lalu os.replace.
+    """
+    with _history_locks_guard:
+        if uid in _history_compacting:
+            return 0
+        _history_compacting.add(uid)
+    try:
+        return _compact_history(uid)
+    finally:
+        with _history_locks_guard:
+            _history_compacting.discard(uid)
+
+
+def _compact_history(uid: int) -> int:
+    t0 = time.perf_counter()
+    path = _history_file(uid)
+    with _history_lock(uid):
+        total, end = _sync_history_index(uid)
+        if not total:
+            return 0
+        with path.open("rb") as f:
+            data = f.read(end)
+    lines = data.splitlines(keepends=True)
+
+    cut = max(len(lines) - HISTORY_KEEP_ENTRIES, 0)
+    if HISTORY_KEEP_DAYS:
+        cutoff = time.time() - HISTORY_KEEP_DAYS * 86400
+        for i in range(len(lines) - 1, cut - 1, -1):
+            entry = HistoryEntry.from_line(lines[i])
+            ts = entry.ts if entry else 0
+            if ts and ts < cutoff:
+                cut = i + 1
+                break
+    # tunggu kelebihannya numpuk dulu biar segmennya gak kecil-kecil,
+    # kecuali ada yang udah lewat umur
+    over_age = cut > len(lines) - HISTORY_KEEP_ENTRIES
+    if not cut or (cut < HISTORY_ARCHIVE_BATCH and not over_age):
+        return 0
+
+    # segmen cuma dibikin compact, dan compact per user gak jalan barengan
+    segs = _archive_segments(uid)
+    seq = _segment_info(segs[-1])[1] + 1 if segs else 1
+    seg_tmp, seg_path, written = _build_archive_segment(uid, seq, seq, cut, lines[:cut])
+
+    keep = lines[cut:]
+    offsets, keep_end = _line_offsets(keep)
+    tmp = path.with_suffix(".tmp")
+    idx_tmp = _history_idx_file(uid).with_suffix(".idx.tmp")
+    try:
+        with tmp.open("wb") as f:
+            f.writelines(keep)
+
+        with _history_lock(uid):
+            # file panas cuma di-append, jadi byte[:end] masih sama;
+            # yang ke-append selama segmen ditulis ikut dipindah ke file baru
+            _, new_end = _sync_history_index(uid)
+            with path.open("rb") as f:
+                f.seek(end)
+                tail = f.read(new_end - end)
+            tail_offsets, pos = _line_offsets(tail.splitlines(keepends=True), keep_end)
+            with tmp.open("ab") as f:
+                f.write(tail)
+            with idx_tmp.open("wb") as fi:
+                fi.write(b"".join(_IDX.pack(o) for o in offsets + tail_offsets))
+            # segmen dulu baru file panas: crash di tengah paling bikin dobel
+            os.replace(seg_tmp, seg_path)
+            os.replace(tmp, path)
+            os.replace(idx_tmp, _history_idx_file(uid))
+    finally:
+        for p in (seg_tmp, tmp, idx_tmp):
+            p.unlink(missing_ok=True)
+
+    written += _merge_archive_segments(uid)
+    record_io(
+        "history_archive", time.perf_counter() - t0,
+        bytes_read=len(data) + len(tail), bytes_written=written + pos,
+    )
+    return cut
 
 
-def add_history(uid: int, akun: str, produk: str):
-    db = load_json(HISTORY_FILE, {})
-    lst = db.get(str(uid), [])
-    lst.append({"akun": akun, "produk": produk})
-    db[str(uid)] = lst
-    save_json(HISTORY_FILE, db)
+async def history_compact_loop():
+    """
+    Background task: tiap HISTORY_COMPACT_INTERVAL, compact riwayat user
+    yang nambah sejak putaran sebelumnya (putaran pertama: semua user).
+    """
+    first = True
+    while True:
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+        if first:
+            first = False
+            try:
+                uids = {int(p.stem) for p in HISTORY_DIR.glob("*.jsonl") if p.stem.isdigit()}
+            except OSError:
+                uids = set()
+        else:
+            uids = set()
+        with _history_locks_guard:
+            uids |= _history_touched
+            _history_touched.clear()
+        moved = 0
+        for uid in uids:
+            try:
+                moved += await run_storage(compact_history, uid)
+            except OSError as e:
+                print(f"[history] compact {uid} gagal: {e}")
+        if moved:
+            print(f"[history] {moved} entry dipindah ke arsip ({len(uids)} user dicek)")
 
 # ======================================
 # STOK HANDLER (internal)
@@ -436,32 +1573,434 @@ def get_stok_file(produk_key: str) -> Path:
     return STOK_CAPCUT
 
 
+# File stok tetap teks biasa 1 akun per baris (farmer cukup append).
+# Yang sudah diambil gak langsung dihapus: posisi baca (byte offset)
+# disimpan di stok_xxx.txt.head, jadi ambil 1 akun = seek + tulis offset.
+# Bagian depan yang sudah kepakai dibuang belakangan oleh compact_stok()
+# (tiap STOK_COMPACT_INTERVAL, asal ada yang kepakai), jadi isi file di
+# disk balik lagi = sisa stok.
+#
+# Head juga nyimpen sidik baris terakhir yang udah diambil (panjang +
+# hash). Offset cuma dipercaya kalau baris itu masih pas berakhir di
+# offset tsb. Kalau file diedit / ditimpa admin, baris itu dicari ulang:
+# ketemu = lanjut habis baris itu (yang udah kejual gak kejual lagi),
+# gak ketemu = stok baru, mulai dari awal.
+
+# Compact nge-flock file stok (lama & baru); farmer_ubot ambil flock yang
+# sama waktu append, jadi append-nya gak jatuh ke file lama yang udah
+# diganti. Penulis lain yang gak pakai flock tetap ketangkep: sisa byte
+# yang masuk ke file lama setelah dibaca disalin ke file baru.
+
+STOK_COMPACT_INTERVAL = int(os.getenv("STOK_COMPACT_INTERVAL", "300"))  # detik
+
+
+# Cache jumlah stok per produk: {produk_key: (ino, size, mtime_ns, count)}.
+# Dikurangi waktu ambil akun, ditambah incremental kalau file cuma
+# bertambah panjang (farmer append). Selain itu (diedit manual, diganti)
+# dihitung ulang dari head.
+_stok_count = {}
+# 1 lock per produk: ambil / compact / hitung ulang 1 file gak boleh barengan
+_stok_locks = {key: threading.Lock() for key in PRODUCTS}
+
+
+def _stok_lock(produk_key: str) -> threading.Lock:
+    return _stok_locks.get(produk_key) or _stok_locks["CAPCUT"]
+
+
+def _stok_sig(st):
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _head_file(stok_file: Path) -> Path:
+    return stok_file.with_name(stok_file.name + ".head")
+
+
+def _line_hash(line: bytes) -> str:
+    return hashlib.sha1(line).hexdigest()[:16]
+
+
+def _read_head(stok_file: Path, f, st):
+    """
+    Offset baca stok + sidik baris terakhir yang udah diambil.
+    Format file head: "<offset> <inode> <panjang baris> <hash baris>".
+    f = file stok yang lagi dibuka (posisinya diubah). Balikin
+    (offset, sidik); sidik None kalau mulai dari awal.
+    """
+    try:
+        parts = _head_file(stok_file).read_text().split()
+        offset, ino = int(parts[0]), int(parts[1])
+        fp = (int(parts[2]), parts[3]) if len(parts) >= 4 else None
+    except (OSError, ValueError, IndexError):
+        return 0, None
+    if offset <= 0:
+        return 0, None
+
+    if fp is None:
+        # head format lama (tanpa sidik): percaya kalau inode sama dan
+        # offset pas di awal baris
+        if ino == st.st_ino and offset <= st.st_size:
+            f.seek(offset - 1)
+            if f.read(1) == b"\n":
+                return offset, None
+        return 0, None
+
+    n, h = fp
+    start = offset - n
+    if 0 <= start and offset <= st.st_size:
+        f.seek(max(start - 1, 0))
+        buf = f.read(n + (1 if start else 0))
+        line = buf[1:] if start else buf
+        if line.endswith(b"\n") and (not start or buf[:1] == b"\n") and _line_hash(line) == h:
+            return offset, fp
+
+    # file diedit / ditimpa: cari baris terakhir yang udah diambil
+    f.seek(0)
+    pos = 0
+    for line in f:
+        pos += len(line)
+        if len(line) == n and _line_hash(line) == h:
+            record_io("stok_head_resync", bytes_read=pos)
+            return pos, fp
+    record_io("stok_head_resync", bytes_read=pos)
+    print(f"[stok] {stok_file.name} diganti, head mulai dari awal")
+    return 0, None
+
+
+def _write_head(stok_file: Path, offset: int, ino: int, fp=None) -> int:
+    head = _head_file(stok_file)
+    tmp = head.with_name(head.name + ".tmp")
+    data = f"{offset} {ino} {fp[0]} {fp[1]}" if fp else f"{offset} {ino}"
+    tmp.write_text(data)
+    os.replace(tmp, head)
+    return len(data)
+
+
+def take_accounts(produk_key: str, n: int) -> list:
+    """Ambil sampai n akun sekaligus: 1x baca file stok + 1x tulis head."""
+    stok_file = get_stok_file(produk_key)
+    if n <= 0 or not stok_file.exists():
+        return []
+
+    with _stok_lock(produk_key):
+        return _take_accounts_locked(produk_key, stok_file, n)
+
+
+def _take_accounts_locked(produk_key: str, stok_file: Path, n: int) -> list:
+    t0 = time.perf_counter()
+    akun_list = []
+    with stok_file.open("rb") as f:
+        st = os.fstat(f.fileno())
+        head, fp = _read_head(stok_file, f, st)
+        start = head
+        f.seek(head)
+        while len(akun_list) < n:
+            line = f.readline()
+            if not line:
+                break
+            head = f.tell()
+            fp = (len(line), _line_hash(line))
+            akun = line.decode("utf-8", errors="replace").strip()
+            if akun:
+                akun_list.append(akun)
+
+    written = _write_head(stok_file, head, st.st_ino, fp)
+
+    cached = _stok_count.get(produk_key)
+    if cached and cached[:3] == _stok_sig(st):
+        _stok_count[produk_key] = cached[:3] + (max(cached[3] - len(akun_list), 0),)
+    else:
+        _stok_count.pop(produk_key, None)
+    record_io(
+        "take_accounts", time.perf_counter() - t0,
+        bytes_read=head - start, bytes_written=written,
+    )
+    return akun_list
+
+
 def ambil_satu_akun(produk_key: str):
+    akun_list = take_accounts(produk_key, 1)
+    return akun_list[0] if akun_list else None
+
+
+def compact_stok(produk_key: str) -> bool:
+    """
+    Buang bagian stok yang sudah diambil (sebelum offset head), kalau ada.
+    Append yang masuk selama proses ikut kebawa ke file baru (lihat
+    komentar di atas).
+    """
     stok_file = get_stok_file(produk_key)
     if not stok_file.exists():
-        return None
-
-    lines = [l.strip() for l in stok_file.read_text().splitlines() if l.strip()]
-    if not lines:
-        return None
+        return False
 
-    akun = lines[0]
-    sisa = lines[1:]
+    with _stok_lock(produk_key):
+        return _compact_stok_locked(produk_key, stok_file)
+
+
+def _flock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _compact_stok_locked(produk_key: str, stok_file: Path) -> bool:
+    with stok_file.open("rb") as f:
+        _flock(f)
+        st = os.fstat(f.fileno())
+        head, _ = _read_head(stok_file, f, st)
+        if not head:
+            return False
+        f.seek(head)
+        sisa = f.read()
+
+        tmp = stok_file.with_name(stok_file.name + ".compact")
+        with tmp.open("wb") as out:
+            _flock(out)  # farmer yang buka nama file setelah replace nunggu di sini
+            out.write(sisa)
+            out.flush()
+            os.fsync(out.fileno())
+            os.replace(tmp, stok_file)
+
+            # append yang sempat masuk ke file lama (sebelum replace) disalin
+            extra = f.read()
+            if extra:
+                out.write(extra)
+                out.flush()
+                os.fsync(out.fileno())
+            new_st = os.fstat(out.fileno())
+            _write_head(stok_file, 0, new_st.st_ino)
+
+    cached = _stok_count.get(produk_key)
+    if cached and not extra and cached[:3] == _stok_sig(st):
+        _stok_count[produk_key] = _stok_sig(new_st) + (cached[3],)
+    else:
+        _stok_count.pop(produk_key, None)
+    return True
 
-    with stok_file.open("w", encoding="utf-8") as f:
-        for s in sisa:
-            f.write(s + "\n")
 
-    return akun
+async def stok_compact_loop():
+    """Background task: compact semua file stok tiap STOK_COMPACT_INTERVAL."""
+    while True:
+        await asyncio.sleep(STOK_COMPACT_INTERVAL)
+        for key in PRODUCTS:
+            try:
+                await compact_stok_async(key)
+            except OSError as e:
+                print(f"[stok] compact {key} gagal: {e}")
 
 
 def count_stok(produk_key: str) -> int:
-    """Hitung sisa stok akun di file stok."""
+    """
+    Sisa stok akun. Biasanya langsung dari cache (cuma 1x stat);
+    file cuma dibaca kalau berubah dari luar.
+    """
+    t0 = time.perf_counter()
+    try:
+        return _count_stok(produk_key)
+    finally:
+        record_io("count_stok", time.perf_counter() - t0)
+
+
+def _count_stok(produk_key: str) -> int:
     stok_file = get_stok_file(produk_key)
-    if not stok_file.exists():
+    try:
+        st = stok_file.stat()
+    except FileNotFoundError:
+        _stok_count.pop(produk_key, None)
         return 0
-    lines = [l.strip() for l in stok_file.read_text().splitlines() if l.strip()]
-    return len(lines)
+
+    cached = _stok_count.get(produk_key)
+    if cached and cached[:3] == _stok_sig(st):
+        return cached[3]
+
+    with _stok_lock(produk_key):
+        return _recount_stok_locked(produk_key, stok_file)
+
+
+def _recount_stok_locked(produk_key: str, stok_file: Path) -> int:
+    cached = _stok_count.get(produk_key)
+    with stok_file.open("rb") as f:
+        st = os.fstat(f.fileno())
+        if cached and cached[:3] == _stok_sig(st):
+            return cached[3]
+        old_ino, old_size = (cached[0], cached[1]) if cached else (None, 0)
+        if old_ino == st.st_ino and 0 < old_size <= st.st_size:
+            # cuma nambah di belakang: hitung bagian barunya aja
+            f.seek(old_size - 1)
+            if f.read(1) == b"\n":
+                count = cached[3] + sum(1 for line in f if line.strip())
+                _stok_count[produk_key] = _stok_sig(st) + (count,)
+                record_io("count_stok", bytes_read=st.st_size - old_size)
+                return count
+        start, _ = _read_head(stok_file, f, st)
+        f.seek(start)
+        count = sum(1 for line in f if line.strip())
+        record_io("count_stok", bytes_read=st.st_size - start)
+
+    _stok_count[produk_key] = _stok_sig(st) + (count,)
+    return count
+
+# ======================================
+# ASYNC STORAGE API
+# ======================================
+# Semua yang nyentuh disk (SQLite, file riwayat, file stok) dijalankan
+# di thread pool terbatas, jadi handler gak nge-block event loop.
+# Handler pakai versi *_async di bawah; cache premium cukup dipanggil
+# langsung karena cuma operasi memori.
+
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+
+_storage_pool = ThreadPoolExecutor(
+    max_workers=STORAGE_WORKERS,
+    thread_name_prefix="storage",
+)
+
+
+async def run_storage(fn, *args, **kwargs):
+    """Jalankan fungsi storage (blocking) di thread pool storage."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _storage_pool, functools.partial(fn, *args, **kwargs)
+    )
+
+
+async def set_lang_async(uid: int, lang: str):
+    await run_storage(set_lang, uid, lang)
+
+
+async def get_history_page_async(uid: int, page: int):
+    return await run_storage(get_history_page, uid, page)
+
+
+async def export_history_async(uid: int, fmt: str = "txt", produk_key=None, since=None, until=None):
+    return await run_storage(export_history, uid, fmt, produk_key, since, until)
+
+
+async def add_history_batch_async(uid: int, akun_list, produk_key: str):
+    await run_storage(add_history_batch, uid, akun_list, produk_key)
+
+
+# Antrian per produk di sisi event loop: yang nunggu giliran stok VIU
+# nunggu di sini (gak makan thread storage), jadi CANVA dkk tetap jalan.
+_stok_async_locks = {key: asyncio.Lock() for key in PRODUCTS}
+
+
+def _stok_async_lock(produk_key: str) -> asyncio.Lock:
+    return _stok_async_locks.get(produk_key) or _stok_async_locks["CAPCUT"]
+
+
+async def take_accounts_async(produk_key: str, n: int) -> list:
+    async with _stok_async_lock(produk_key):
+        return await run_storage(take_accounts, produk_key, n)
+
+
+async def compact_stok_async(produk_key: str) -> bool:
+    async with _stok_async_lock(produk_key):
+        return await run_storage(compact_stok, produk_key)
+
+
+async def count_stok_async(produk_key: str) -> int:
+    return await run_storage(count_stok, produk_key)
+
+
+def count_all_stok() -> dict:
+    return {key: count_stok(key) for key in PRODUCTS}
+
+
+async def count_all_stok_async() -> dict:
+    return await run_storage(count_all_stok)
+
+# ======================================
+# USER CONTEXT (per update)
+# ======================================
+# Bahasa, role, sisa sewa & pemakaian quota hari ini di-load SEKALI per
+# update oleh handler group -1 (load_user_context), lalu disimpan di
+# context.user_data["ctx"]. Handler lain tinggal pakai get_user_ctx().
+
+def load_user_ctx(uid: int) -> dict:
+    lang = get_lang(uid)
+    rec = get_premium_rec(uid) or {}
+
+    if is_admin(uid):
+        role = "admin"
+    elif is_premium(uid):
+        role = "premium"
+    else:
+        role = "free"
+
+    today = _today()
+    quota = {p_key: quota_used(rec, p_key, today) for p_key in PRODUCT_LIMIT}
+    return {
+        "uid": uid,
+        "lang": lang,
+        "role": role,
+        "sisa_sewa": get_sisa_sewa(uid),
+        "quota": quota,
+    }
+
+
+async def load_user_context(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler group -1: isi context.user_data["ctx"] buat update ini."""
+    user = update.effective_user
+    if user is None or context.user_data is None:
+        return
+    uctx = await run_storage(load_user_ctx, user.id)
+    uctx["update_id"] = update.update_id
+    context.user_data["ctx"] = uctx
+
+
+async def get_user_ctx(update: Update, context: ContextTypes.DEFAULT_TYPE) -> dict:
+    uctx = context.user_data.get("ctx") if context.user_data is not None else None
+    if not uctx or uctx.get("update_id") != update.update_id:
+        await load_user_context(update, context)
+        uctx = context.user_data["ctx"]
+    return uctx
+
+# ======================================
+# UPDATE PROCESSOR (per-user lane)
+# ======================================
+
+class UserLaneUpdateProcessor(BaseUpdateProcessor):
+    """
+    Proses update secara paralel, kecuali update dari user yang sama:
+    itu diantrekan per uid biar tetap urut. Update tanpa user (misal
+    channel post) cuma kena batas paralel.
+
+    Semaphore bawaan PTB diambil SEBELUM do_process_update, jadi update
+    yang lagi nunggu giliran user-nya ikut megang slot; 1 user yang spam
+    tombol bisa ngabisin semua slot. Makanya semaphore bawaan dibikin
+    longgar, dan batas aslinya diambil di sini setelah giliran user tiba.
+    """
+
+    _UNLIMITED = 2**30
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(self._UNLIMITED)
+        self._running = asyncio.BoundedSemaphore(max(max_concurrent_updates, 1))
+        self._user_locks = {}  # uid -> [asyncio.Lock, jumlah update yang nunggu/jalan]
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
 
 # ======================================
 # KEYBOARD LAYOUTS
@@ -521,15 +2060,15 @@ def premium_keyboard():
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    uid = user.id
-    lang = get_lang(uid)
+    uctx = await get_user_ctx(update, context)
+    lang = uctx["lang"]
     nama = user.first_name or (user.username or "User")
 
     # Role info
-    if is_admin(uid):
+    if uctx["role"] == "admin":
         role_id = "Admin"
         role_en = "Admin"
-    elif is_premium(uid):
+    elif uctx["role"] == "premium":
         role_id = "Premium"
         role_en = "Premium"
     else:
@@ -576,8 +2115,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    uid = q.from_user.id
-    lang = get_lang(uid)
+    uctx = await get_user_ctx(update, context)
+    uid = uctx["uid"]
+    lang = uctx["lang"]
     data = q.data
 
     # menu kategori
@@ -630,6 +2170,8 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             _, produk_key, qty_str = data.split("_", 2)
             jumlah = int(qty_str)
+            if jumlah not in QUANTITY_OPTIONS:
+                raise ValueError(jumlah)
         except Exception:
             if lang == "en":
                 await q.message.reply_text("Unknown button format. Please /start again.")
@@ -638,7 +2180,7 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         produk_nama = PRODUCTS.get(produk_key, produk_key)
-        await generate_multiple(q, uid, produk_key, produk_nama, jumlah, lang)
+        await generate_multiple(q, uctx, produk_key, produk_nama, jumlah)
         return
 
     # tombol lihat harga plan detail
@@ -681,8 +2223,17 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # menu lain
     if data == "SAVED":
         await show_saved(q, uid, lang)
+    elif data.startswith("SAVED_"):
+        # navigasi halaman riwayat: SAVED_<page>
+        try:
+            page = int(data.split("_", 1)[1])
+        except ValueError:
+            page = 0
+        await show_saved(q, uid, lang, page=page, edit=True)
+    elif data in ("EXPORT_TXT", "EXPORT_CSV"):
+        await send_history_export(q.message, uid, lang, data.split("_", 1)[1].lower())
     elif data == "SEWA":
-        await show_sewa(q, uid, lang)
+        await show_sewa(q, uctx)
     elif data == "HELP":
         await show_help(q, lang)
     elif data == "BACK_HOME":
@@ -714,6 +2265,7 @@ async def show_quantity_menu(q, produk_key: str, produk_nama: str, lang: str):
         )
         btn10 = "🔟 Generate 10 accounts"
         btn20 = "2️⃣0️⃣ Generate 20 accounts"
+        btn50 = "5️⃣0️⃣ Generate 50 accounts (.txt file)"
         back = "⬅️ Back to main menu"
     else:
         msg = (
@@ -722,6 +2274,7 @@ async def show_quantity_menu(q, produk_key: str, produk_nama: str, lang: str):
         )
         btn10 = "🔟 Generate 10 akun"
         btn20 = "2️⃣0️⃣ Generate 20 akun"
+        btn50 = "5️⃣0️⃣ Generate 50 akun (file .txt)"
         back = "⬅️ Kembali ke menu utama"
 
     keyboard = InlineKeyboardMarkup([
@@ -729,6 +2282,9 @@ async def show_quantity_menu(q, produk_key: str, produk_nama: str, lang: str):
             InlineKeyboardButton(btn10, callback_data=f"Q_{produk_key}_10"),
             InlineKeyboardButton(btn20, callback_data=f"Q_{produk_key}_20"),
         ],
+        [
+            InlineKeyboardButton(btn50, callback_data=f"Q_{produk_key}_50"),
+        ],
         [
             InlineKeyboardButton(back, callback_data="BACK_HOME"),
         ],
@@ -744,9 +2300,23 @@ async def show_quantity_menu(q, produk_key: str, produk_nama: str, lang: str):
 # GENERATE MULTI AKUN
 # ======================================
 
-async def generate_multiple(q, uid: int, produk_key: str, produk_nama: str, jumlah_awal: int, lang: str):
+def _stok_kosong_text(produk_nama: str, lang: str) -> str:
+    if lang == "en":
+        return (
+            f"😿 Account quota for <b>{produk_nama}</b> is currently unavailable.\n"
+            "Please contact admin if you need more accounts."
+        )
+    return (
+        f"😿 Kuota akun untuk <b>{produk_nama}</b> sedang tidak tersedia.\n"
+        "Silakan hubungi admin jika kamu membutuhkan tambahan akun."
+    )
+
+
+async def generate_multiple(q, uctx: dict, produk_key: str, produk_nama: str, jumlah_awal: int):
+    uid = uctx["uid"]
+    lang = uctx["lang"]
     # cek akses premium / admin
-    if not (is_admin(uid) or is_premium(uid)):
+    if uctx["role"] == "free":
         if lang == "en":
             text = (
                 "🚫 Your premium access is not active yet.\n"
@@ -760,29 +2330,42 @@ async def generate_multiple(q, uid: int, produk_key: str, produk_nama: str, juml
         await q.message.reply_text(text)
         return
 
-    update_quota(uid)
-    jumlah = jumlah_awal
+    if await count_stok_async(produk_key) <= 0:
+        await q.message.reply_text(
+            _stok_kosong_text(produk_nama, lang),
+            parse_mode="HTML",
+        )
+        return
+
+    # pesan quota sekaligus (admin gak kena limit per produk)
+    jumlah = reserve_quota(
+        uid, produk_key, jumlah_awal, unlimited=uctx["role"] == "admin"
+    )
+    if jumlah <= 0:
+        if lang == "en":
+            text = (
+                f"❌ Your daily limit for {produk_nama} is already reached.\n"
+                "Please try again tomorrow."
+            )
+        else:
+            text = (
+                f"❌ Limit harian kamu untuk {produk_nama} sudah tercapai.\n"
+                "Kamu bisa generate lagi besok."
+            )
+        await q.message.reply_text(text)
+        return
+
+    # hasil diisi _deliver_batch begitu akun keluar dari stok, jadi kalau
+    # kirim pesannya gagal pun quota tetap kecatat sesuai yang diambil
+    hasil = []
+    try:
+        await _deliver_batch(q, uid, produk_key, produk_nama, jumlah, lang, hasil)
+    finally:
+        commit_quota(uid, produk_key, jumlah, len(hasil))
 
-    # cek limit per produk (kecuali admin)
-    if not is_admin(uid):
-        used, limit = get_quota_info(uid, produk_key)
-        sisa = limit - used
-        if sisa <= 0:
-            if lang == "en":
-                text = (
-                    f"❌ Your daily limit for {produk_nama} is already reached.\n"
-                    "Please try again tomorrow."
-                )
-            else:
-                text = (
-                    f"❌ Limit harian kamu untuk {produk_nama} sudah tercapai.\n"
-                    "Kamu bisa generate lagi besok."
-                )
-            await q.message.reply_text(text)
-            return
-        if jumlah > sisa:
-            jumlah = sisa
 
+async def _deliver_batch(q, uid: int, produk_key: str, produk_nama: str, jumlah: int, lang: str, hasil: list):
+    """Ambil akun dari stok ke list hasil & kirim ke user."""
     # notif proses
     if lang == "en":
         proses_msg = await q.message.reply_text(
@@ -799,30 +2382,18 @@ async def generate_multiple(q, uid: int, produk_key: str, produk_nama: str, juml
             parse_mode="HTML",
         )
 
-    hasil = []
+    hasil.extend(await take_accounts_async(produk_key, jumlah))
+    if not hasil:
+        await proses_msg.edit_text(
+            _stok_kosong_text(produk_nama, lang),
+            parse_mode="HTML",
+        )
+        return
 
-    for _ in range(jumlah):
-        akun = ambil_satu_akun(produk_key)
-        if not akun:
-            break
-        hasil.append(akun)
-        increment_quota(uid, produk_key)
-        add_history(uid, akun, produk_nama)
-        # anti-spam delay
-        await asyncio.sleep(0.6)
+    await add_history_batch_async(uid, hasil, produk_key)
 
-    if not hasil:
-        if lang == "en":
-            text = (
-                f"😿 Account quota for <b>{produk_nama}</b> is currently unavailable.\n"
-                "Please contact admin if you need more accounts."
-            )
-        else:
-            text = (
-                f"😿 Kuota akun untuk <b>{produk_nama}</b> sedang tidak tersedia.\n"
-                "Silakan hubungi admin jika kamu membutuhkan tambahan akun."
-            )
-        await proses_msg.edit_text(text, parse_mode="HTML")
+    if len(hasil) > BATCH_DOC_THRESHOLD:
+        await _deliver_as_document(q, proses_msg, produk_key, produk_nama, lang, hasil)
         return
 
     lines = []
@@ -847,15 +2418,49 @@ async def generate_multiple(q, uid: int, produk_key: str, produk_nama: str, juml
             "🔁 Semua akun ini juga tersimpan di menu <b>Riwayat Akun</b> kamu."
         )
 
+    if len(text) > MESSAGE_LIMIT:
+        # akun kepanjangan (misal VIU), gak muat 1 pesan
+        await _deliver_as_document(q, proses_msg, produk_key, produk_nama, lang, hasil)
+        return
     await proses_msg.edit_text(text, parse_mode="HTML")
 
+
+async def _deliver_as_document(q, proses_msg, produk_key: str, produk_nama: str, lang: str, hasil: list):
+    """Kirim batch sebagai file .txt (1 akun per baris) + ringkasan singkat."""
+    buf = io.BytesIO("".join(f"{a}\n" for a in hasil).encode("utf-8"))
+    filename = f"{produk_key.lower()}_{len(hasil)}_{datetime.now():%Y%m%d_%H%M%S}.txt"
+
+    if lang == "en":
+        text = (
+            f"✅ <b>{produk_nama} generation complete!</b>\n"
+            "━━━━━━━━━━━━━━━━━━━━━━━\n"
+            f"📦 Accounts in this batch: <b>{len(hasil)}</b>\n"
+            "📄 The list is sent as a .txt file below.\n\n"
+            "🔁 All these accounts are also stored in your <b>History</b> menu."
+        )
+    else:
+        text = (
+            f"✅ <b>Generate {produk_nama} selesai!</b>\n"
+            "━━━━━━━━━━━━━━━━━━━━━━━\n"
+            f"📦 Jumlah akun di batch ini: <b>{len(hasil)}</b>\n"
+            "📄 Daftar akunnya dikirim sebagai file .txt di bawah.\n\n"
+            "🔁 Semua akun ini juga tersimpan di menu <b>Riwayat Akun</b> kamu."
+        )
+
+    await proses_msg.edit_text(text, parse_mode="HTML")
+    if lang == "en":
+        caption = f"📄 {produk_nama}: {len(hasil)} accounts"
+    else:
+        caption = f"📄 {produk_nama}: {len(hasil)} akun"
+    await q.message.reply_document(document=buf, filename=filename, caption=caption)
+
 # ======================================
 # RIWAYAT, SEWA, HELP
 # ======================================
 
-async def show_saved(q, uid: int, lang: str):
-    hist = get_history(uid)
-    if not hist:
+async def show_saved(q, uid: int, lang: str, page: int = 0, edit: bool = False):
+    entries, total, page, archived = await get_history_page_async(uid, page)
+    if not total:
         if lang == "en":
             text = (
                 "📦 History is empty.\n"
@@ -869,31 +2474,122 @@ async def show_saved(q, uid: int, lang: str):
         await q.message.reply_text(text)
         return
 
+    pages = max((total - archived + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
     lines = [
-        f"{i+1}. [{h['produk']}] <code>{h['akun']}</code>"
-        for i, h in enumerate(hist)
+        f"{no}. [{h.nama}] <code>{h.akun}</code>"
+        for no, h in entries
     ]
 
     if lang == "en":
         text = (
             "📦 <b>Your Account History</b>\n"
             "━━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"Total accounts you have generated: <b>{len(hist)}</b>\n\n"
+            f"Total accounts you have generated: <b>{total}</b>\n"
+            f"Page {page + 1}/{pages} (newest first)\n"
+            + (f"Entries 1–{archived} are archived, use the download buttons below.\n" if archived else "")
+            + "\n"
             + "\n".join(lines)
         )
     else:
         text = (
             "📦 <b>Riwayat Akun Kamu</b>\n"
             "━━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"Total akun yang pernah kamu ambil: <b>{len(hist)}</b>\n\n"
+            f"Total akun yang pernah kamu ambil: <b>{total}</b>\n"
+            f"Halaman {page + 1}/{pages} (terbaru duluan)\n"
+            + (f"Entry 1–{archived} sudah diarsipkan, download lewat tombol di bawah.\n" if archived else "")
+            + "\n"
             + "\n".join(lines)
         )
 
-    await q.message.reply_text(text, parse_mode="HTML")
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(
+            "⬅️ Newer" if lang == "en" else "⬅️ Lebih baru",
+            callback_data=f"SAVED_{page - 1}",
+        ))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton(
+            "Older ➡️" if lang == "en" else "Lebih lama ➡️",
+            callback_data=f"SAVED_{page + 1}",
+        ))
+    rows = [nav] if nav else []
+    rows.append([
+        InlineKeyboardButton("📥 Download TXT", callback_data="EXPORT_TXT"),
+        InlineKeyboardButton("📥 Download CSV", callback_data="EXPORT_CSV"),
+    ])
+    keyboard = InlineKeyboardMarkup(rows)
 
+    if edit:
+        await q.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    else:
+        await q.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard)
 
-async def show_sewa(q, uid: int, lang: str):
-    if is_admin(uid):
+
+async def send_history_export(message, uid: int, lang: str, fmt: str = "txt",
+                              produk_key=None, since=None, until=None):
+    buf, n = await export_history_async(uid, fmt, produk_key, since, until)
+    if not n:
+        if lang == "en":
+            text = "📦 No history matches that filter."
+        else:
+            text = "📦 Tidak ada riwayat yang cocok dengan filter itu."
+        await message.reply_text(text)
+        return
+
+    if lang == "en":
+        caption = f"📦 Account history: {n} entries"
+    else:
+        caption = f"📦 Riwayat akun: {n} entry"
+    await message.reply_document(
+        document=buf,
+        filename=f"riwayat_{uid}_{datetime.now():%Y%m%d}.{fmt}",
+        caption=caption,
+    )
+
+
+def _export_usage(lang: str) -> str:
+    if lang == "en":
+        return (
+            "Usage: /export [txt|csv] [PRODUCT] [from YYYY-MM-DD] [to YYYY-MM-DD]\n"
+            "Example: /export csv VIU 2026-01-01 2026-01-31\n"
+            "Products: " + ", ".join(PRODUCTS)
+        )
+    return (
+        "Gunakan: /export [txt|csv] [PRODUK] [dari YYYY-MM-DD] [sampai YYYY-MM-DD]\n"
+        "Contoh: /export csv VIU 2026-01-01 2026-01-31\n"
+        "Produk: " + ", ".join(PRODUCTS)
+    )
+
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export — download riwayat sebagai dokumen, bisa difilter produk & tanggal."""
+    uid = update.effective_user.id
+    lang = (await get_user_ctx(update, context))["lang"]
+
+    fmt, produk_key, dates = "txt", None, []
+    for arg in context.args:
+        if arg.lower() in ("txt", "csv"):
+            fmt = arg.lower()
+        elif arg.upper() in PRODUCTS:
+            produk_key = arg.upper()
+        else:
+            try:
+                dates.append(datetime.strptime(arg, "%Y-%m-%d").date())
+            except ValueError:
+                await update.message.reply_text(_export_usage(lang))
+                return
+    if len(dates) > 2:
+        await update.message.reply_text(_export_usage(lang))
+        return
+    since = dates[0] if dates else None
+    until = dates[1] if len(dates) > 1 else None
+
+    await send_history_export(update.message, uid, lang, fmt, produk_key, since, until)
+
+
+async def show_sewa(q, uctx: dict):
+    lang = uctx["lang"]
+    if uctx["role"] == "admin":
         if lang == "en":
             text = (
                 "👑 You are admin.\n"
@@ -907,7 +2603,7 @@ async def show_sewa(q, uid: int, lang: str):
         await q.message.reply_text(text)
         return
 
-    if not is_premium(uid):
+    if uctx["role"] != "premium":
         if lang == "en":
             text = (
                 "⏳ Your premium access is not active.\n"
@@ -921,10 +2617,8 @@ async def show_sewa(q, uid: int, lang: str):
         await q.message.reply_text(text)
         return
 
-    sisa = get_sisa_sewa(uid)
-    db = get_premium_db()
-    rec = db.get(str(uid), {})
-    quota = rec.get("quota", {})
+    sisa = uctx["sisa_sewa"]
+    quota = uctx["quota"]
 
     if lang == "en":
         text = (
@@ -941,12 +2635,10 @@ async def show_sewa(q, uid: int, lang: str):
             "Pemakaian harian per produk (hari ini):\n"
         )
 
-    today = date.today().strftime("%Y-%m-%d")
     lines = []
     for p_key, p_name in PRODUCTS.items():
         limit = PRODUCT_LIMIT.get(p_key, 0)
-        entry = quota.get(p_key, {})
-        cnt = entry.get("count", 0) if entry.get("date") == today else 0
+        cnt = quota.get(p_key, 0)
         lines.append(f"• {p_name}: <b>{cnt}/{limit}</b>")
 
     text += "\n".join(lines)
@@ -961,9 +2653,10 @@ async def show_help(q, lang: str):
             "━━━━━━━━━━━━━━━━━━━━━━━\n\n"
             "1️⃣ Use /start → choose Blank or Premium generator.\n"
             "2️⃣ Pick the service (Canva, CapCut, Scribd, etc.).\n"
-            "3️⃣ Choose how many accounts you want (10 or 20).\n"
+            "3️⃣ Choose how many accounts you want (10, 20 or 50).\n"
             "4️⃣ Wait for the generator to finish, accounts will appear.\n"
-            "5️⃣ All generated accounts are stored in 📦 History.\n\n"
+            "5️⃣ All generated accounts are stored in 📦 History.\n"
+            "    Download them with /export (filter: product, date).\n\n"
             "For price & rental plans, use /plans or the 💸 Harga Sewa button.\n"
             "For support, tap the Admin button on the main menu."
         )
@@ -973,9 +2666,10 @@ async def show_help(q, lang: str):
             "━━━━━━━━━━━━━━━━━━━━━━━\n\n"
             "1️⃣ Gunakan /start → pilih Generator Kosongan atau Premium.\n"
             "2️⃣ Pilih layanan (Canva, CapCut, Scribd, dll).\n"
-            "3️⃣ Pilih jumlah akun yang mau digenerate (10 atau 20).\n"
+            "3️⃣ Pilih jumlah akun yang mau digenerate (10, 20 atau 50).\n"
             "4️⃣ Tunggu proses generator selesai, akun akan muncul.\n"
-            "5️⃣ Semua akun yang pernah kamu ambil tersimpan di 📦 Riwayat Akun.\n\n"
+            "5️⃣ Semua akun yang pernah kamu ambil tersimpan di 📦 Riwayat Akun.\n"
+            "    Download lewat /export (filter: produk, tanggal).\n\n"
             "Untuk harga & paket sewa gunakan /plans atau tombol 💸 Harga Sewa.\n"
             "Untuk bantuan, gunakan tombol Admin di menu utama."
         )
@@ -987,8 +2681,7 @@ async def show_help(q, lang: str):
 # ======================================
 
 async def show_plans_menu_from_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = update.effective_user.id
-    lang = get_lang(uid)
+    lang = (await get_user_ctx(update, context))["lang"]
     await show_plans_menu(update, lang)
 
 
@@ -1088,11 +2781,13 @@ async def delpremium(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Format: /delpremium <user_id>")
         return
 
-    uid_str = context.args[0]
-    db = get_premium_db()
-    if uid_str in db:
-        db.pop(uid_str)
-        save_premium_db(db)
+    try:
+        uid = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("User ID harus berupa angka.")
+        return
+
+    if del_premium(uid):
         await update.message.reply_text("✅ User tersebut dihapus dari premium.")
     else:
         await update.message.reply_text("User tidak ditemukan di list premium.")
@@ -1126,9 +2821,10 @@ async def stok_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(uid):
         return
 
+    stok = await count_all_stok_async()
     lines = []
     for key, name in PRODUCTS.items():
-        sisa = count_stok(key)
+        sisa = stok[key]
         lines.append(f"• {name}: <b>{sisa}</b> akun tersisa")
 
     text = (
@@ -1138,6 +2834,116 @@ async def stok_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(text, parse_mode="HTML")
 
+
+async def metrics_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/metrics: latency handler & statistik I/O. Admin only, user lain di-silent."""
+    if not is_admin(update.effective_user.id):
+        return
+    await update.message.reply_text(metrics_text(), parse_mode="HTML")
+
+# ======================================
+# /PROFILE (ADMIN, HIDDEN)
+# ======================================
+# cProfile nyala N detik di traffic live, cuma di thread event loop
+# (Python 3.12+ nolak cProfile kedua yang aktif barengan). Waktu di
+# thread storage diambil dari selisih IO_STATS selama jendela profiling.
+
+PROFILE_MAX_SECONDS = 300
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_DEFAULT_TOP = 40
+
+_profiling = False
+_profiling_lock = threading.Lock()
+
+
+def _io_snapshot():
+    with _metrics_lock:
+        return {
+            name: (st["calls"], st["latency"].sum, st["bytes_read"], st["bytes_written"])
+            for name, st in IO_STATS.items()
+        }
+
+
+def _io_delta_text(before, after) -> str:
+    rows = []
+    for name, (calls, total, br, bw) in after.items():
+        c0, t0, br0, bw0 = before.get(name, (0, 0.0, 0, 0))
+        if calls - c0 or br - br0 or bw - bw0:
+            rows.append((total - t0, name, calls - c0, br - br0, bw - bw0))
+    if not rows:
+        return "Storage: gak ada operasi I/O.\n"
+    rows.sort(reverse=True)
+    lines = [f"{'storage (IO_STATS)':<24}{'calls':>8}{'total ms':>12}{'read KB':>10}{'write KB':>10}"]
+    for total, name, calls, br, bw in rows:
+        lines.append(f"{name:<24}{calls:>8}{total * 1000:>12.1f}{br / 1024:>10.1f}{bw / 1024:>10.1f}")
+    return "\n".join(lines) + "\n"
+
+
+async def _run_profile(bot, chat_id: int, seconds: int, top: int):
+    global _profiling
+    prof = cProfile.Profile()
+    io_before = _io_snapshot()
+    try:
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+    finally:
+        with _profiling_lock:
+            _profiling = False
+    io_after = _io_snapshot()
+
+    out = io.StringIO()
+    out.write(f"Profile {seconds} detik (thread event loop), top {top} by cumulative time\n\n")
+    out.write(_io_delta_text(io_before, io_after))
+    out.write("\n")
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(top)
+
+    doc = io.BytesIO(out.getvalue().encode("utf-8"))
+    await bot.send_document(
+        chat_id,
+        document=doc,
+        filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt",
+        caption=f"⏱ Profil {seconds} detik (top {top}, cumulative)",
+    )
+
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [detik] [top_n]: profiling live traffic. Admin only, user lain di-silent."""
+    if not is_admin(update.effective_user.id):
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+        top = int(context.args[1]) if len(context.args) > 1 else PROFILE_DEFAULT_TOP
+    except ValueError:
+        await update.message.reply_text("Format: /profile <detik> <top_n>")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    top = max(top, 1)
+
+    global _profiling
+    with _profiling_lock:
+        busy = _profiling
+        _profiling = True
+    if busy:
+        await update.message.reply_text("Profiler masih jalan, tunggu selesai dulu.")
+        return
+
+    try:
+        await update.message.reply_text(
+            f"⏱ Profiler jalan {seconds} detik, hasilnya dikirim sebagai file."
+        )
+        # jalan di background biar lane admin gak ke-block selama profiling
+        context.application.create_task(
+            _run_profile(context.bot, update.effective_chat.id, seconds, top)
+        )
+    except BaseException:
+        with _profiling_lock:
+            _profiling = False
+        raise
+
 # ======================================
 # /LANGUAGE (HIDDEN)
 # ======================================
@@ -1157,7 +2963,7 @@ async def language_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Bahasa hanya mendukung: id / en")
         return
 
-    set_lang(uid, lang)
+    await set_lang_async(uid, lang)
     if lang == "en":
         await update.message.reply_text("✅ Bot language set to English.")
     else:
@@ -1168,8 +2974,7 @@ async def language_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ======================================
 
 async def fallback_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    uid = update.effective_user.id
-    lang = get_lang(uid)
+    lang = (await get_user_ctx(update, context))["lang"]
     if lang == "en":
         text = "Hi 👋\nUse /start to open the main menu."
     else:
@@ -1177,22 +2982,118 @@ async def fallback_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text)
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def post_init(app):
+    # buka DB + migrasi data lama + isi cache premium sebelum update pertama masuk
+    await run_storage(_premium_db)
+    app.bot_data["premium_flush_task"] = asyncio.create_task(premium_flush_loop())
+    app.bot_data["stok_compact_task"] = asyncio.create_task(stok_compact_loop())
+    app.bot_data["history_compact_task"] = asyncio.create_task(history_compact_loop())
+    app.bot_data["loop_lag_task"] = asyncio.create_task(loop_lag_monitor())
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = start_metrics_server(METRICS_PORT)
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("plans", show_plans_menu_from_cmd))
-    app.add_handler(CommandHandler("language", language_cmd))
 
-    app.add_handler(CommandHandler("addpremium", addpremium))
-    app.add_handler(CommandHandler("delpremium", delpremium))
-    app.add_handler(CommandHandler("listpremium", listpremium))
-    app.add_handler(CommandHandler("stok", stok_cmd))  # admin only, hidden
+async def post_shutdown(app):
+    for name in ("premium_flush_task", "stok_compact_task", "history_compact_task", "loop_lag_task"):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    await run_storage(flush_premium_db)
+    _storage_pool.shutdown(wait=True)
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        server.shutdown()
 
-    app.add_handler(CallbackQueryHandler(handle_buttons))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, fallback_msg))
 
-    app.run_polling()
+def build_application(request=None, get_updates_request=None):
+    """
+    Rakit Application + semua handler. request / get_updates_request bisa
+    diisi BaseRequest lain (misal stub buat benchmark); default HTTPXRequest.
+    """
+    request = request or HTTPXRequest(
+        connection_pool_size=HTTP_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=HTTP_VERSION,
+    )
+    get_updates_request = get_updates_request or HTTPXRequest(
+        connection_pool_size=GET_UPDATES_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=GET_UPDATES_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=HTTP_VERSION,
+    )
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .base_url(TELEGRAM_BASE_URL)
+        .base_file_url(TELEGRAM_BASE_FILE_URL)
+        .concurrent_updates(
+            UserLaneUpdateProcessor(MAX_CONCURRENT_UPDATES)
+        )
+        .rate_limiter(
+            AIORateLimiter(
+                overall_max_rate=RATE_OVERALL_PER_SEC,
+                overall_time_period=1,
+                group_max_rate=RATE_GROUP_PER_MIN,
+                group_time_period=60,
+                max_retries=RATE_MAX_RETRIES,
+            )
+        )
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    app.add_handler(TypeHandler(Update, timed(load_user_context)), group=-1)
+
+    app.add_handler(CommandHandler("start", timed(start)))
+    app.add_handler(CommandHandler("plans", timed(show_plans_menu_from_cmd)))
+    app.add_handler(CommandHandler("language", timed(language_cmd)))
+    app.add_handler(CommandHandler("export", timed(export_cmd)))
+
+    app.add_handler(CommandHandler("addpremium", timed(addpremium)))
+    app.add_handler(CommandHandler("delpremium", timed(delpremium)))
+    app.add_handler(CommandHandler("listpremium", timed(listpremium)))
+    app.add_handler(CommandHandler("stok", timed(stok_cmd)))  # admin only, hidden
+    app.add_handler(CommandHandler("metrics", timed(metrics_cmd)))  # admin only, hidden
+    app.add_handler(CommandHandler("profile", timed(profile_cmd)))  # admin only, hidden
+
+    app.add_handler(CallbackQueryHandler(timed(handle_buttons)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed(fallback_msg)))
+    return app
+
+
+# Cuma jenis update yang ada handler-nya; sisanya (chat_member, reaction,
+# dll) gak usah dikirim Telegram, biar gak ikut lewat load_user_context.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+def main():
+    app = build_application()
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL wajib diisi kalau BOT_MODE=webhook!")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+"""
+Load test offline buat all.py — tanpa network, tanpa token asli.
+
+Tiap user simulasi jalanin alur:
+    /start -> GEN_BLANK -> P_CANVA -> Q_CANVA_20 -> SAVED
+dan admin sesekali kirim /stok. Semua request ke Bot API dijawab stub
+(StubRequest), update diproses lewat update processor yang sama dengan
+bot aslinya (per-user lane), data ditulis ke folder sementara (DATA_DIR).
+
+Contoh:
+    python bench_load.py --users 2000
+    python bench_load.py --users 500 --api-latency 20 --rate-limit
+
+Output: latency p50/p95/p99 per langkah, throughput, dan I/O per
+interaksi (syscall read/write + byte, dari /proc/self/io — Linux saja).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import importlib
+from pathlib import Path
+
+ADMIN_ID = 7321522905
+BENCH_TOKEN = "123456:BENCHMARK"
+FLOW = ["/start", "GEN_BLANK", "P_CANVA", "Q_CANVA_20", "SAVED"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--users", type=int, default=1000, help="jumlah user simulasi")
+    p.add_argument("--concurrency", type=int, default=0, help="user aktif barengan (0 = semua)")
+    p.add_argument("--stok-every", type=int, default=10, help="admin kirim /stok tiap N user (0 = gak usah)")
+    p.add_argument("--api-latency", type=float, default=0.0, help="delay stub Bot API per request (ms)")
+    p.add_argument("--rate-limit", action="store_true", help="pakai rate limiter bawaan bot (default dimatiin)")
+    p.add_argument("--data-dir", help="folder data baru/kosong (default: folder sementara baru)")
+    p.add_argument("--json", action="store_true", help="output JSON")
+    return p.parse_args()
+
+
+# ======================================
+# I/O COUNTER (/proc/self/io)
+# ======================================
+
+def read_proc_io():
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+# ======================================
+# STUB BOT API
+# ======================================
+
+def make_stub_request_class():
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Jawab semua method Bot API di memori (opsional pakai delay)."""
+
+        def __init__(self, latency_ms: float = 0.0):
+            self.latency = latency_ms / 1000
+            self.calls = {}
+            self._msg_id = 0
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api = url.rsplit("/", 1)[-1]
+            self.calls[api] = self.calls.get(api, 0) + 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+            params = request_data.parameters if request_data else {}
+            if api == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            elif api in ("sendMessage", "editMessageText", "sendDocument"):
+                self._msg_id += 1
+                chat_id = int(params.get("chat_id") or 1)
+                result = {
+                    "message_id": params.get("message_id") or self._msg_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": params.get("text", ""),
+                }
+            elif api == "getUpdates":
+                result = []
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return StubRequest
+
+# ======================================
+# UPDATE SINTETIS
+# ======================================
+
+# Builder JSON update (format Bot API); dipakai juga fake_botapi.py.
+
+def user_json(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+
+
+def command_json(update_id, uid, text):
+    cmd = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": user_json(uid),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(cmd)}],
+        },
+    }
+
+
+def callback_json(update_id, uid, cb_data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user_json(uid),
+            "chat_instance": str(uid),
+            "data": cb_data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+
+    def command(self, uid, text):
+        from telegram import Update
+
+        self.update_id += 1
+        return Update.de_json(command_json(self.update_id, uid, text), self.bot)
+
+    def callback(self, uid, cb_data):
+        from telegram import Update
+
+        self.update_id += 1
+        return Update.de_json(callback_json(self.update_id, uid, cb_data), self.bot)
+
+# ======================================
+# RUNNER
+# ======================================
+
+# file yang nandain folder data bot beneran; folder kayak gini gak boleh
+# dipakai load test (stok ditimpa, user simulasi dikasih premium)
+BOT_DATA_FILES = ("vanzbot.db", "premium.json", "history.json", "language.json")
+
+
+def check_data_dir(data_dir: Path, flag: str = "--data-dir"):
+    if not data_dir.exists():
+        return
+    used = sorted(
+        p.name for p in data_dir.iterdir()
+        if p.name in BOT_DATA_FILES or (p.name.startswith("stok_") and p.suffix == ".txt")
+    )
+    if used:
+        sys.exit(
+            f"{flag} {data_dir} sudah berisi data bot ({', '.join(used)}); "
+            "pakai folder baru / kosong biar stok & data asli gak ketimpa."
+        )
+
+
+def prepare_data_dir(data_dir: Path, users: int, prefix: str = "bench", flag: str = "--data-dir"):
+    """Tulis stok_canva.txt (users*20 akun) ke folder data baru/kosong."""
+    check_data_dir(data_dir, flag)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    stok = data_dir / "stok_canva.txt"
+    with stok.open("w", encoding="utf-8") as f:
+        for i in range(max(users, 1) * 20):
+            f.write(f"{prefix}{i:07d}@example.com|masuk123\n")
+
+
+async def run(args):
+    bot_mod = importlib.import_module("all")
+    StubRequest = make_stub_request_class()
+    stub = StubRequest(args.api_latency)
+
+    app = bot_mod.build_application(request=stub, get_updates_request=StubRequest())
+    await app.initialize()
+    await bot_mod.post_init(app)
+
+    first_uid = 10_000_000
+    uids = list(range(first_uid, first_uid + args.users))
+    for uid in uids:
+        bot_mod.grant_premium_days(uid, 30)
+    await bot_mod.run_storage(bot_mod.flush_premium_db)
+
+    factory = UpdateFactory(app.bot)
+    latencies = {step: [] for step in FLOW + ["/stok"]}
+    processor = app.update_processor
+    sem = asyncio.Semaphore(args.concurrency or args.users)
+
+    async def send(step, update):
+        t0 = time.perf_counter()
+        await processor.process_update(update, app.process_update(update))
+        latencies[step].append(time.perf_counter() - t0)
+
+    async def user_flow(idx, uid):
+        async with sem:
+            for step in FLOW:
+                if step.startswith("/"):
+                    upd = factory.command(uid, step)
+                else:
+                    upd = factory.callback(uid, step)
+                await send(step, upd)
+            if args.stok_every and idx % args.stok_every == 0:
+                await send("/stok", factory.command(ADMIN_ID, "/stok"))
+
+    io_before = read_proc_io()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user_flow(i, uid) for i, uid in enumerate(uids)))
+    elapsed = time.perf_counter() - t0
+    io_after = read_proc_io()
+
+    await bot_mod.post_shutdown(app)
+    await app.shutdown()
+
+    interactions = sum(len(v) for v in latencies.values())
+    report = {
+        "users": args.users,
+        "interactions": interactions,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(interactions / elapsed, 1) if elapsed else 0.0,
+        "steps": {
+            step: {
+                "count": len(v),
+                "p50_ms": round(percentile(v, 50) * 1000, 3),
+                "p95_ms": round(percentile(v, 95) * 1000, 3),
+                "p99_ms": round(percentile(v, 99) * 1000, 3),
+            }
+            for step, v in latencies.items() if v
+        },
+        "api_calls": stub.calls,
+    }
+    if io_before and io_after and interactions:
+        delta = {k: io_after[k] - io_before.get(k, 0) for k in io_after}
+        report["io_per_interaction"] = {
+            "read_syscalls": round(delta.get("syscr", 0) / interactions, 2),
+            "write_syscalls": round(delta.get("syscw", 0) / interactions, 2),
+            "read_bytes": round(delta.get("rchar", 0) / interactions, 1),
+            "write_bytes": round(delta.get("wchar", 0) / interactions, 1),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"users: {report['users']}  interactions: {report['interactions']}  "
+          f"elapsed: {report['elapsed_s']} s  throughput: {report['throughput_per_s']}/s")
+    print()
+    print(f"{'step':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, s in report["steps"].items():
+        print(f"{step:<14}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    io = report.get("io_per_interaction")
+    if io:
+        print()
+        print("I/O per interaksi: "
+              f"{io['read_syscalls']} read / {io['write_syscalls']} write syscall, "
+              f"{io['read_bytes']} B dibaca / {io['write_bytes']} B ditulis")
+    print()
+    print("Bot API calls:", ", ".join(f"{k}={v}" for k, v in sorted(report["api_calls"].items())))
+
+
+def main():
+    args = parse_args()
+    data_dir = Path(args.data_dir or tempfile.mkdtemp(prefix="vanzbench-"))
+    prepare_data_dir(data_dir, args.users)
+
+    # env harus di-set sebelum all.py di-import (config dibaca waktu import)
+    os.environ["DATA_DIR"] = str(data_dir)
+    os.environ.setdefault("BOT_TOKEN", BENCH_TOKEN)
+    if not args.rate_limit:
+        os.environ["RATE_OVERALL_PER_SEC"] = "1000000000"
+    sys.path.insert(0, str(Path(__file__).parent))
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        print(f"\ndata: {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
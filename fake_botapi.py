@@ -0,0 +1,378 @@
+"""
+Fake Telegram Bot API server lokal buat load test end-to-end (full HTTP).
+
+Server ini pura-pura jadi api.telegram.org: bot (all.py) konek lewat
+HTTP beneran, jadi connection pool, serialisasi request, rate limiter
+& penanganan RetryAfter ikut keuji. Sekalian server ini jadi "user":
+N user simulasi jalanin alur
+    /start -> GEN_BLANK -> P_CANVA -> Q_CANVA_20 -> SAVED
+dan tiap langkah berikutnya baru dikirim setelah bot selesai balas
+langkah sebelumnya (closed loop).
+
+Method yang didukung: getMe, getUpdates, setWebhook, deleteWebhook,
+sendMessage, editMessageText, answerCallbackQuery, sendDocument
+(method lain dijawab ok/True).
+
+Contoh (2 terminal):
+    python fake_botapi.py --users 200 --latency 30 --error-rate 0.02 --seed-dir /tmp/vanzdata
+    BOT_TOKEN=1:fake DATA_DIR=/tmp/vanzdata \\
+        TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python all.py
+
+Mode webhook: jalankan bot dengan BOT_MODE=webhook dan kasih
+--webhook http://127.0.0.1:8443/telegram (+ --secret kalau WEBHOOK_SECRET
+di-set); update dikirim ke bot lewat POST, bukan getUpdates. Alur baru
+mulai waktu bot manggil setWebhook, dan POST yang gagal diulang pakai
+backoff kayak Telegram beneran.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from pathlib import Path
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_load import ADMIN_ID, FLOW, percentile, prepare_data_dir, command_json, callback_json
+
+FIRST_UID = 20_000_000
+WEBHOOK_RETRY_MIN = 0.5     # detik, backoff awal POST webhook yang gagal
+WEBHOOK_RETRY_MAX = 30.0
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--users", type=int, default=100, help="jumlah user simulasi (0 = server doang)")
+    p.add_argument("--latency", type=float, default=0.0, help="delay tiap method (ms)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="peluang balas 429 (0..1)")
+    p.add_argument("--retry-after", type=int, default=1, help="retry_after di balasan 429 (detik)")
+    p.add_argument("--admin-id", type=int, default=ADMIN_ID, help="ID admin bot (buat /addpremium)")
+    p.add_argument("--no-grant", action="store_true", help="jangan /addpremium user simulasi dulu")
+    p.add_argument("--seed-dir", help="tulis stok_canva.txt (users*20 akun) ke folder baru/kosong ini dulu")
+    p.add_argument("--webhook", help="URL webhook bot; kalau diisi update di-POST ke sini")
+    p.add_argument("--secret", help="secret token webhook (X-Telegram-Bot-Api-Secret-Token)")
+    p.add_argument("--doc-threshold", type=int, default=20,
+                   help="samain dengan BATCH_DOC_THRESHOLD bot: langkah Q_ di atas ini nunggu sendDocument")
+    p.add_argument("--forever", action="store_true", help="jangan berhenti setelah semua user selesai")
+    return p.parse_args()
+
+# ======================================
+# STATE SIMULASI
+# ======================================
+
+class Simulation:
+    """Antrian update + progres alur tiap user. Diakses dari banyak thread."""
+
+    def __init__(self, args):
+        self.args = args
+        self.cond = threading.Condition()
+        self.updates = []           # update yang belum di-ack bot
+        self.next_update_id = 1
+        self.msg_id = 0
+        self.calls = {}
+        self.injected_429 = 0
+        self.pending = {}           # chat_id -> (step, waktu update dikirim)
+        self.progress = {}          # uid -> index langkah berikutnya
+        self.latencies = {step: [] for step in FLOW + ["/addpremium"]}
+        self.grant_queue = []
+        self.started = None
+        self.finished = None
+        self.done_users = 0
+        self.webhook_queue = []
+
+    # ---------- bikin update ----------
+
+    def _push(self, chat_id, step, upd):
+        """Masukin update ke antrian (panggil di bawah self.cond)."""
+        self.next_update_id += 1
+        self.pending[chat_id] = (step, time.perf_counter())
+        if self.args.webhook:
+            self.webhook_queue.append(upd)
+        else:
+            self.updates.append(upd)
+        self.cond.notify_all()
+
+    def push_command(self, uid, text, step):
+        self._push(uid, step, command_json(self.next_update_id, uid, text))
+
+    def push_callback(self, uid, data):
+        self._push(uid, data, callback_json(self.next_update_id, uid, data))
+
+    def push_step(self, uid):
+        idx = self.progress[uid]
+        step = FLOW[idx]
+        if step.startswith("/"):
+            self.push_command(uid, step, step)
+        else:
+            self.push_callback(uid, step)
+
+    # ---------- alur ----------
+
+    def start(self):
+        with self.cond:
+            if self.started is not None:
+                return
+            self.started = time.perf_counter()
+            uids = range(FIRST_UID, FIRST_UID + self.args.users)
+            for uid in uids:
+                self.progress[uid] = 0
+            if self.args.no_grant:
+                for uid in uids:
+                    self.push_step(uid)
+            else:
+                # admin kasih premium satu-satu dulu, alur user mulai setelahnya
+                self.grant_queue = list(uids)
+                self._next_grant()
+
+    def _next_grant(self):
+        if not self.grant_queue:
+            for uid in self.progress:
+                self.push_step(uid)
+            return
+        uid = self.grant_queue.pop()
+        self.push_command(self.args.admin_id, f"/addpremium {uid} 30", "/addpremium")
+
+    def expects_document(self, step):
+        """Langkah Q_<PRODUK>_<jumlah> di atas --doc-threshold dibalas bot pakai file."""
+        if not step.startswith("Q_"):
+            return False
+        try:
+            return int(step.rsplit("_", 1)[1]) > self.args.doc_threshold
+        except ValueError:
+            return False
+
+    def on_bot_message(self, chat_id, text, method="sendMessage"):
+        """
+        Bot kirim / edit pesan ke chat_id. Pesan progres (🔄) belum dianggap
+        selesai; langkah yang nunggu file cuma selesai di sendDocument, dan
+        sendDocument yang gak ditunggu (misal fallback pesan kepanjangan,
+        ringkasannya udah nutup langkah) diabaikan.
+        """
+        if text.startswith("🔄"):
+            return
+        with self.cond:
+            pending = self.pending.get(chat_id)
+            if not pending:
+                return
+            step, t0 = pending
+            if self.expects_document(step) != (method == "sendDocument"):
+                return
+            del self.pending[chat_id]
+            self.latencies[step].append(time.perf_counter() - t0)
+
+            if chat_id == self.args.admin_id and step == "/addpremium":
+                self._next_grant()
+                return
+            if chat_id not in self.progress:
+                return
+            self.progress[chat_id] += 1
+            if self.progress[chat_id] < len(FLOW):
+                self.push_step(chat_id)
+            else:
+                self.done_users += 1
+                if self.done_users == len(self.progress):
+                    self.finished = time.perf_counter()
+                    self.cond.notify_all()
+
+    # ---------- getUpdates ----------
+
+    def get_updates(self, offset, timeout, limit):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if offset:
+                    self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if self.updates or time.monotonic() >= deadline:
+                    return self.updates[:limit]
+                self.cond.wait(max(deadline - time.monotonic(), 0))
+
+# ======================================
+# HTTP HANDLER
+# ======================================
+
+def parse_body(handler):
+    length = int(handler.headers.get("Content-Length") or 0)
+    raw = handler.rfile.read(length) if length else b""
+    ctype = handler.headers.get("Content-Type", "")
+    if "application/json" in ctype:
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+    if "multipart/form-data" in ctype:
+        params = {}
+        for name, value in re.findall(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', raw, re.S):
+            if len(value) < 4096:
+                params[name.decode()] = value.decode("utf-8", errors="replace")
+        return params
+    return {k: v[0] for k, v in parse_qs(raw.decode("utf-8")).items()}
+
+
+def make_handler(sim: Simulation):
+    args = sim.args
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, biar pool koneksi bot kepake
+
+        def log_message(self, *a):
+            pass
+
+        def _reply(self, status, payload):
+            out = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            method = self.path.rsplit("/", 1)[-1].split("?")[0]
+            params = parse_body(self)
+            with sim.cond:
+                sim.calls[method] = sim.calls.get(method, 0) + 1
+
+            if method == "getUpdates":
+                updates = sim.get_updates(
+                    int(params.get("offset") or 0),
+                    float(params.get("timeout") or 0),
+                    int(params.get("limit") or 100),
+                )
+                self._reply(200, {"ok": True, "result": updates})
+                return
+
+            if args.latency:
+                time.sleep(args.latency / 1000)
+
+            if method not in ("getMe", "setWebhook") and args.error_rate and random.random() < args.error_rate:
+                with sim.cond:
+                    sim.injected_429 += 1
+                self._reply(429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {args.retry_after}",
+                    "parameters": {"retry_after": args.retry_after},
+                })
+                return
+
+            if method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+            elif method == "setWebhook":
+                self._reply(200, {"ok": True, "result": True})
+                # mode webhook: alur baru jalan setelah bot daftarin webhook-nya
+                if args.webhook and args.users:
+                    sim.start()
+                return
+            elif method in ("sendMessage", "editMessageText", "sendDocument"):
+                chat_id = int(params.get("chat_id") or 0)
+                text = params.get("text") or params.get("caption") or ""
+                with sim.cond:
+                    sim.msg_id += 1
+                    msg_id = sim.msg_id
+                result = {
+                    "message_id": int(params.get("message_id") or msg_id),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": text,
+                }
+                self._reply(200, {"ok": True, "result": result})
+                sim.on_bot_message(chat_id, text, method)
+                return
+            else:
+                result = True
+            self._reply(200, {"ok": True, "result": result})
+
+    return Handler
+
+# ======================================
+# WEBHOOK PUSHER
+# ======================================
+
+def webhook_pusher(sim: Simulation):
+    headers = {"Content-Type": "application/json"}
+    if sim.args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = sim.args.secret
+    while True:
+        with sim.cond:
+            while not sim.webhook_queue:
+                sim.cond.wait()
+            batch, sim.webhook_queue = sim.webhook_queue, []
+        for upd in batch:
+            deliver_webhook(sim, upd, headers)
+
+
+def deliver_webhook(sim: Simulation, upd, headers):
+    """POST satu update; kalau gagal diulang pakai backoff (kayak Telegram) sampai masuk."""
+    data = json.dumps(upd).encode()
+    delay = WEBHOOK_RETRY_MIN
+    while True:
+        req = urllib.request.Request(sim.args.webhook, data=data, headers=headers)
+        try:
+            urllib.request.urlopen(req, timeout=10).read()
+            return
+        except OSError as e:
+            print(f"[webhook] gagal kirim update {upd['update_id']}: {e}; ulang {delay:.1f}s lagi",
+                  file=sys.stderr)
+        time.sleep(delay)
+        delay = min(delay * 2, WEBHOOK_RETRY_MAX)
+
+# ======================================
+# MAIN
+# ======================================
+
+def print_report(sim: Simulation):
+    if sim.started is None:
+        print("alur belum mulai (bot belum manggil setWebhook?)")
+        print("Bot API calls:", ", ".join(f"{k}={v}" for k, v in sorted(sim.calls.items())))
+        return
+    elapsed = (sim.finished or time.perf_counter()) - sim.started
+    total = sum(len(v) for v in sim.latencies.values())
+    print(f"users: {len(sim.progress)}  steps: {total}  elapsed: {elapsed:.3f} s  "
+          f"throughput: {total / elapsed:.1f} step/s  429 injected: {sim.injected_429}")
+    print()
+    print(f"{'step':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, v in sim.latencies.items():
+        if v:
+            print(f"{step:<14}{len(v):>8}{percentile(v, 50) * 1000:>10.1f}"
+                  f"{percentile(v, 95) * 1000:>10.1f}{percentile(v, 99) * 1000:>10.1f}")
+    print()
+    print("Bot API calls:", ", ".join(f"{k}={v}" for k, v in sorted(sim.calls.items())))
+
+
+def main():
+    args = parse_args()
+    if args.seed_dir:
+        prepare_data_dir(Path(args.seed_dir), args.users, prefix="fake", flag="--seed-dir")
+
+    sim = Simulation(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(sim))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if args.webhook:
+        threading.Thread(target=webhook_pusher, args=(sim,), daemon=True).start()
+
+    print(f"fake Bot API jalan di http://{args.host}:{args.port}/bot<token>/<method>")
+    if args.users and not args.webhook:
+        sim.start()
+    try:
+        with sim.cond:
+            while args.forever or not args.users or sim.finished is None:
+                sim.cond.wait(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        if args.users:
+            print_report(sim)
+
+
+if __name__ == "__main__":
+    main()
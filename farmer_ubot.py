@@ -1,5 +1,10 @@
 import os
 import asyncio
+
+try:
+    import fcntl
+except ImportError:  # Windows: append tanpa lock
+    fcntl = None
 from pathlib import Path
 from dotenv import load_dotenv
 from telethon import TelegramClient
@@ -123,9 +128,22 @@ def append_to_file(path: Path, lines):
     if not lines:
         return
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("a", encoding="utf-8") as f:
-        for line in lines:
-            f.write(line.rstrip() + "\n")
+    data = "".join(line.rstrip() + "\n" for line in lines)
+    while True:
+        f = path.open("a", encoding="utf-8")
+        if fcntl is None:
+            break
+        # lock yang sama dipakai bot waktu compact stok; kalau file-nya
+        # keburu diganti (inode beda) selama nunggu, buka ulang
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == path.stat().st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    with f:
+        f.write(data)
 
 
 # ========== PARSER HASIL VIU TEXT ==========